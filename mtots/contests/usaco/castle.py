@@ -3,19 +3,14 @@ ID: math4to3
 TASK: castle
 LANG: PYTHON3
 """
+from array import array
 
 
 def main(open):
     with open('castle.in') as f:
-        lines = f.read().strip().splitlines()
-        M, N = map(int, lines[0].split())
-        walls_gen = iter(
-            int(word) for line in lines[1:] for word in line.split()
-        )
-        walls = [[None for _ in range(M)] for _ in range(N)]
-        for r in range(N):
-            for c in range(M):
-                walls[r][c] = next(walls_gen)
+        data = f.read().split()
+        M, N = int(data[0]), int(data[1])
+        walls = array('B', map(int, data[2:2 + M * N]))
 
     R, max_room_size, combined_room_size, removed_wall_name = (
         solve(M, N, walls)
@@ -28,93 +23,66 @@ def main(open):
         f.write(f'{removed_wall_name}\n')
 
 
-def solve(M, N, walls):
-    assert len(walls) == N, [len(walls), N]
-    assert len(walls[0]) == M, [len(walls[0]), M]
-
-    WEST = 1
-    NORTH = 2
-    EAST = 4
-    SOUTH = 8
-    DIRS = (NORTH, SOUTH, EAST, WEST)
-
-    def dir_id(dir):
-        if dir == EAST:
-            return 'E'
-        elif dir == NORTH:
-            return 'N'
-        assert False, dir
-
-    def _move(r, c, dir):
-        if dir == NORTH:
-            return r - 1, c
-        elif dir == SOUTH:
-            return r + 1, c
-        elif dir == EAST:
-            return r, c + 1
-        elif dir == WEST:
-            return r, c - 1
-        assert False, dir
-
-    def move(r, c, dir):
-        r, c = _move(r, c, dir)
-        return (r, c) if r in range(N) and c in range(M) else None
-
-    R = 0
-    room = [[None for _ in range(M)] for _ in range(N)]
-    room_size = []
+WEST = 1
+NORTH = 2
+EAST = 4
+SOUTH = 8
 
-    def fill(r, c, R):
-        assert len(room_size) == R, [len(room_size), R]
-        room_size.append(1)
-        room[r][c] = R
-        queue = [(r, c)]
-        while queue:
-            r, c = queue.pop()
-            for dir in DIRS:
-                if not (walls[r][c] & dir):
-                    nr, nc = move(r, c, dir)
-                    if room[nr][nc] is None:
-                        room[nr][nc] = R
-                        room_size[-1] += 1
-                        queue.append((nr, nc))
-
-    for r in range(N):
-        for c in range(M):
-            if room[r][c] is None:
-                fill(r, c, R)
-                R += 1
 
-    # Find which wall to tear down
+def solve(M, N, walls):
+    """walls is a flat row-major grid of wall bitmasks,
+    i.e. the walls of row r, column c are walls[r * M + c]
+    """
+    assert len(walls) == M * N, [len(walls), M, N]
+    size = M * N
+
+    # Label every module with its room with an iterative flood fill
+    room = array('i', [-1]) * size
+    room_size = []
+    for first in range(size):
+        if room[first] >= 0:
+            continue
+        R = len(room_size)
+        room[first] = R
+        count = 1
+        stack = [first]
+        while stack:
+            i = stack.pop()
+            w = walls[i]
+            c = i % M
+            for blocked, j in (
+                    (w & NORTH or i < M, i - M),
+                    (w & SOUTH or i >= size - M, i + M),
+                    (w & EAST or c == M - 1, i + 1),
+                    (w & WEST or c == 0, i - 1)):
+                if not blocked and room[j] < 0:
+                    room[j] = R
+                    count += 1
+                    stack.append(j)
+        room_size.append(count)
+
+    # Find which wall to tear down, preferring the westmost module,
+    # then the southmost, then N over E
     combined_room_size = 0
+    removed_wall_name = None
     for c in range(M):
         for r in reversed(range(N)):
-            for dir in (NORTH, EAST):
-                # If there's no wall, there's nothing to do
-                if not (walls[r][c] & dir):
-                    continue
-
-                # If we've walked off the edge, there's nothing to do
-                neighb = move(r, c, dir)
-                if neighb is None:
-                    continue
-
-                # If both sides of the wall are the same room,
-                # there's nothing to do
-                nr, nc = neighb
-                if room[r][c] == room[nr][nc]:
-                    continue
-
-                new_room_size = (
-                    room_size[room[r][c]] +
-                    room_size[room[nr][nc]]
-                )
-                if new_room_size > combined_room_size:
-                    combined_room_size = new_room_size
-                    removed_wall_name = f'{r + 1} {c + 1} {dir_id(dir)}'
+            i = r * M + c
+            w = walls[i]
+            a = room[i]
+            if w & NORTH and r > 0:
+                b = room[i - M]
+                if a != b and room_size[a] + room_size[b] > combined_room_size:
+                    combined_room_size = room_size[a] + room_size[b]
+                    removed_wall_name = f'{r + 1} {c + 1} N'
+            if w & EAST and c < M - 1:
+                b = room[i + 1]
+                if a != b and room_size[a] + room_size[b] > combined_room_size:
+                    combined_room_size = room_size[a] + room_size[b]
+                    removed_wall_name = f'{r + 1} {c + 1} E'
 
     return (
-        R,
+        len(room_size),
         max(room_size),
         combined_room_size,
         removed_wall_name,
@@ -143,3 +111,97 @@ else:
 4 1 E
 """,
         })
+
+    def _random_walls(M, N, rng, wall_probability):
+        walls = array('B', [0]) * (M * N)
+        for r in range(N):
+            for c in range(M):
+                i = r * M + c
+                if r == 0:
+                    walls[i] |= NORTH
+                if r == N - 1:
+                    walls[i] |= SOUTH
+                if c == 0:
+                    walls[i] |= WEST
+                if c == M - 1:
+                    walls[i] |= EAST
+                if r > 0 and rng.random() < wall_probability:
+                    walls[i] |= NORTH
+                    walls[i - M] |= SOUTH
+                if c > 0 and rng.random() < wall_probability:
+                    walls[i] |= WEST
+                    walls[i - 1] |= EAST
+        return walls
+
+    def _solve_by_flood_fill(M, N, walls):
+        # Works on a grid of rows, flood filling from scratch for
+        # every room and for every wall that joins two rooms
+        grid = [list(walls[r * M:(r + 1) * M]) for r in range(N)]
+        moves = ((NORTH, -1, 0), (SOUTH, 1, 0), (EAST, 0, 1), (WEST, 0, -1))
+
+        def fill(r, c):
+            seen = {(r, c)}
+            stack = [(r, c)]
+            while stack:
+                r, c = stack.pop()
+                for wall, dr, dc in moves:
+                    cell = (r + dr, c + dc)
+                    if not grid[r][c] & wall and cell not in seen:
+                        seen.add(cell)
+                        stack.append(cell)
+            return seen
+
+        rooms = []
+        for r in range(N):
+            for c in range(M):
+                if not any((r, c) in room for room in rooms):
+                    rooms.append(fill(r, c))
+
+        best = (0, None)
+        for c in range(M):
+            for r in reversed(range(N)):
+                for wall, opposite, dr, dc, name in (
+                        (NORTH, SOUTH, -1, 0, 'N'), (EAST, WEST, 0, 1, 'E')):
+                    if not 0 <= r + dr < N or not 0 <= c + dc < M:
+                        continue
+                    if not grid[r][c] & wall:
+                        continue
+                    if (r + dr, c + dc) in fill(r, c):
+                        continue
+                    grid[r][c] ^= wall
+                    grid[r + dr][c + dc] ^= opposite
+                    size = len(fill(r, c))
+                    grid[r][c] ^= wall
+                    grid[r + dr][c + dc] ^= opposite
+                    if size > best[0]:
+                        best = (size, f'{r + 1} {c + 1} {name}')
+
+        return (len(rooms), max(map(len, rooms))) + best
+
+    @test.case
+    def _random():
+        import random
+        rng = random.Random(2047)
+        for _ in range(300):
+            M = rng.randint(1, 6)
+            N = rng.randint(1, 6)
+            walls = _random_walls(M, N, rng, rng.random())
+            test.equal(solve(M, N, walls), _solve_by_flood_fill(M, N, walls))
+
+    @test.slow
+    def _large():
+        import random
+        rng = random.Random(831)
+        M = N = 500
+        walls = _random_walls(M, N, rng, 0.6)
+        R, max_room_size, combined_room_size, removed_wall_name = (
+            solve(M, N, walls)
+        )
+        test.that(1 < R < M * N)
+        test.that(max_room_size < combined_room_size <= 2 * max_room_size)
+        test.that(removed_wall_name is not None)
+
+    @test.bench(warmup=1, repeat=5)
+    def _bench_large():
+        import random
+        solve(500, 500, _random_walls(500, 500, random.Random(831), 0.6))
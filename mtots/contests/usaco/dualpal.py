@@ -9,32 +9,129 @@ def main(open):
     with open('dualpal.in') as f:
         N, S = map(int, f.read().split())
 
-    numbers = []
-
-    while N > 0:
-        S += 1
-        while True:
-            if is_dualpal(S):
-                numbers.append(S)
-                break
-            S += 1
-        N -= 1
+    numbers = solve(N, S)
 
     with open('dualpal.out', 'w') as f:
         for number in numbers:
             f.write(f'{number}\n')
 
+
+BASES = range(2, 11)
+
+
+def solve(N, S, generate=False):
+    """Returns the first N numbers greater than S that are palindromes
+    in at least two of the bases 2 through 10.
+
+    By default consecutive numbers are checked one at a time, keeping
+    their digits in every base and incrementing them in place.
+    With generate=True, the palindromes of each base are generated
+    directly and merged, which skips over the numbers in between
+    (and so is much faster for large N and S).
+    """
+    if generate:
+        dualpals = _generate_dualpals(S)
+    else:
+        dualpals = _scan_dualpals(S)
+    return [next(dualpals) for _ in range(N)]
+
+
 def is_dualpal(n):
-    return sum(is_pal(n, base) for base in range(2, 11)) >= 2
+    count = 0
+    for base in BASES:
+        if is_pal(n, base):
+            count += 1
+            if count >= 2:
+                return True
+    return False
 
 
 def is_pal(n, base):
-    digits = []
-    while n:
-        digits.append(n % base)
-        n //= base
-
-    return digits == list(reversed(digits))
+    "Checks by reversing the digits of n arithmetically"
+    reversed_n = 0
+    m = n
+    while m:
+        m, digit = divmod(m, base)
+        reversed_n = reversed_n * base + digit
+    return reversed_n == n
+
+
+def _scan_dualpals(S):
+    n = S + 1
+
+    # Digits of n in each base, least significant first
+    all_digits = []
+    for base in BASES:
+        digits = []
+        m = n
+        while m:
+            m, digit = divmod(m, base)
+            digits.append(digit)
+        all_digits.append(digits)
+
+    while True:
+        count = 0
+        for digits in all_digits:
+            # Most numbers fail on their first and last digits
+            i = 0
+            j = len(digits) - 1
+            while i < j and digits[i] == digits[j]:
+                i += 1
+                j -= 1
+            if i >= j:
+                count += 1
+                if count >= 2:
+                    yield n
+                    break
+
+        n += 1
+        for base, digits in zip(BASES, all_digits):
+            i = 0
+            while i < len(digits) and digits[i] == base - 1:
+                digits[i] = 0
+                i += 1
+            if i == len(digits):
+                digits.append(1)
+            else:
+                digits[i] += 1
+
+
+def _generate_dualpals(S):
+    import heapq
+    last = None
+    count = 0
+    for n in heapq.merge(*(_palindromes_after(S, base) for base in BASES)):
+        if n == last:
+            count += 1
+            if count == 2:
+                yield n
+        else:
+            last = n
+            count = 1
+
+
+def _palindromes_after(S, base):
+    "Yields the palindromes in the given base greater than S, in order"
+    length = 1
+    while base ** length <= S + 1:
+        length += 1
+    while True:
+        half = (length + 1) // 2
+        low_digits = length - half
+        scale = base ** low_digits
+        first_prefix = max(base ** (half - 1), (S + 1) // scale)
+        for prefix in range(first_prefix, base ** half):
+            # Mirror the prefix (without its middle digit if the
+            # length is odd) into the low digits
+            m = prefix // base if length % 2 else prefix
+            mirrored = 0
+            for _ in range(low_digits):
+                m, digit = divmod(m, base)
+                mirrored = mirrored * base + digit
+            value = prefix * scale + mirrored
+            if value > S:
+                yield value
+        length += 1
 
 
 if __name__ == '__main__':
@@ -100,8 +197,51 @@ class FakeFile:
         return ''.join(self.contents)
 
 
+def _methods_agree():
+    from mtots import test
+
+    def solve_by_brute_force(N, S):
+        numbers = []
+        while len(numbers) < N:
+            S += 1
+            if sum(
+                    str_digits(S, base) == str_digits(S, base)[::-1]
+                    for base in BASES) >= 2:
+                numbers.append(S)
+        return numbers
+
+    def str_digits(n, base):
+        digits = []
+        while n:
+            n, digit = divmod(n, base)
+            digits.append(digit)
+        return digits
+
+    for N, S in [(1, 0), (15, 0), (15, 1), (3, 25), (15, 9998), (20, 255)]:
+        expected = solve_by_brute_force(N, S)
+        test.equal(solve(N, S), expected)
+        test.equal(solve(N, S, generate=True), expected)
+        test.that(all(is_dualpal(n) for n in expected))
+
+
+def _large():
+    from mtots import test
+    numbers = solve(100, 10 ** 9, generate=True)
+    test.equal(len(numbers), 100)
+    test.that(all(n > 10 ** 9 and is_dualpal(n) for n in numbers))
+    test.equal(solve(99, numbers[0], generate=True), numbers[1:])
+    test.equal(solve(1, numbers[1] - 1000), [numbers[1]])
+
+
+def _bench_generate():
+    solve(100, 10 ** 9, generate=True)
+
+
 try:
     import mtots.test
     mtots.test.case(_sample)
+    mtots.test.case(_methods_agree)
+    mtots.test.slow(_large)
+    mtots.test.bench(_bench_generate)
 except ImportError:
     pass
@@ -3,22 +3,35 @@ ID: math4to3
 TASK: frac1
 LANG: PYTHON3
 """
-from fractions import Fraction
 
 
 def main(open):
     with open('frac1.in') as f:
         N = int(f.read())
 
-    fractions = sorted({
-        Fraction(n, d)
-        for d in range(1, N + 1)
-        for n in range(d + 1)
-    })
-
     with open('frac1.out', 'w') as f:
-        for fr in fractions:
-            f.write(f'{fr.numerator}/{fr.denominator}\n')
+        for n, d in farey(N):
+            f.write(f'{n}/{d}\n')
+
+
+def farey(N):
+    """Yields the reduced fractions between 0 and 1 with denominators
+    up to N (the Farey sequence of order N), in increasing order,
+    as (numerator, denominator) pairs.
+
+    Each term follows from the two before it: if a/b and c/d are
+    consecutive, the next term is (k*c - a)/(k*d - b) with
+    k = (N + b) // d.
+    """
+    a, b, c, d = 0, 1, 1, N
+    yield a, b
+    while True:
+        yield c, d
+        if c == d:
+            # 1/1 is the last term
+            return
+        k = (N + b) // d
+        a, b, c, d = c, d, k * c - a, k * d - b
 
 
 if __name__ == '__main__':
@@ -46,3 +59,25 @@ else:
 1/1
 """,
         })
+
+    @test.case
+    def _farey():
+        from fractions import Fraction
+        for N in range(1, 30):
+            test.equal(
+                [Fraction(n, d) for n, d in farey(N)],
+                sorted({
+                    Fraction(n, d)
+                    for d in range(1, N + 1)
+                    for n in range(d + 1)
+                }),
+            )
+
+    @test.slow
+    def _large():
+        test.equal(sum(1 for _ in farey(2000)), 1216589)
+
+    @test.bench(repeat=5)
+    def _bench_large():
+        for _ in farey(2000):
+            pass
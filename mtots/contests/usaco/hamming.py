@@ -3,7 +3,6 @@ ID: math4to3
 TASK: hamming
 LANG: PYTHON3
 """
-import itertools
 
 
 def main(open):
@@ -27,17 +26,17 @@ def main(open):
 def solve(N, B, D):
     INF = 2 ** B * 2
 
-    def dist(a, b):
-        return sum((a >> i) % 2 ^ (b >> i) % 2 for i in range(B))
+    # Sets of codewords are stored as bitmasks (bit i set means
+    # codeword i is in the set), so that removing all the neighbors
+    # of a codeword from a set is a single AND.
+    popcount = [bin(x).count('1') for x in range(2 ** B)]
+    close_differences = [x for x in range(2 ** B) if popcount[x] < D]
+    neighbors_of = [
+        sum(1 << (a ^ x) for x in close_differences)
+        for a in range(2 ** B)
+    ]
 
-    neighbors_of = {}
-    for a in range(2 ** B):
-        neighbors_of[a] = set()
-        for b in range(2 ** B):
-            if dist(a, b) < D:
-                neighbors_of[a].add(b)
-
-    known_impossible = {(): 1}
+    known_impossible = {0: 1}
 
     def recurse(codewords, remaining):
         needed = N - len(codewords)
@@ -45,20 +44,17 @@ def solve(N, B, D):
         if needed <= 0:
             return codewords
 
-        if known_impossible.get(remaining, len(remaining) + 1) <= needed:
+        if known_impossible.get(remaining, INF) <= needed:
             return
 
-        # print(f'codewords = {codewords}, remaining = {remaining}')
-
-        if needed <= len(remaining):
-            for i, val in enumerate(remaining):
-                neighbors = neighbors_of[val]
-                # print(f'val = {val}, neighbors = {neighbors}')
-                new_remaining = tuple(
-                    r
-                    for r in remaining[i + 1:]
-                    if r not in neighbors
-                )
+        if needed <= bin(remaining).count('1'):
+            rest = remaining
+            while rest:
+                lowest = rest & -rest
+                val = lowest.bit_length() - 1
+                rest ^= lowest
+                # Only codewords after val, that are far enough from it
+                new_remaining = rest & ~neighbors_of[val]
                 codewords.append(val)
                 result = recurse(codewords, new_remaining)
                 if result:
@@ -70,7 +66,7 @@ def solve(N, B, D):
             needed,
         )
 
-    return recurse([], tuple(range(2 ** B)))
+    return recurse([], (1 << 2 ** B) - 1)
 
 
 if __name__ == '__main__':
@@ -117,8 +113,8 @@ else:
 
     @test.slow
     def _perf_test_3():
-        # If this was actually required, this would be
-        # too slow (seems to go a bit over 2 seconds on my machine).
+        # If this was actually required, this might be
+        # too slow (takes about 1.5 seconds on my machine).
         # However, at least for this problem, NO SOLUTION
         # cases don't seem to count as valid input cases.
         _testutil.case(main, {
@@ -127,3 +123,10 @@ else:
         }, {
 'hamming.out': """NO SOLUTION
 """,})
+
+    @test.bench
+    def _bench_b8():
+        # For each D, N is the size of the greedy (lexicographic) code
+        for N, D in [(64, 1), (64, 2), (16, 3), (16, 4), (4, 5), (2, 6),
+                     (2, 7)]:
+            solve(N, 8, D)
@@ -13,30 +13,47 @@ def main(open):
         G = int(next(lines))
         feed = [tuple(map(int, next(lines).split())) for _ in range(G)]
 
-    best = None
-
-    for i in range(2 ** G):
-        feed_types = []
-        feed_type = 1
-        vits = [0] * V
-        for feed_type in range(1, G + 1):
-            if (i >> (feed_type - 1)) % 2:
-                feed_types.append(feed_type)
-                for j, vit in enumerate(feed[feed_type - 1]):
-                    vits[j] += vit
-
-        if all(v >= r for v, r in zip(vits, req)):
-            if best is None:
-                best = feed_types
-
-            if (len(feed_types) < len(best) or
-                    (len(feed_types) == len(best) and feed_types < best)):
-                best = feed_types
+    best = solve(req, feed)
 
     with open('holstein.out', 'w') as f:
         f.write(f'{len(best)} {" ".join(map(str, best))}\n')
 
 
+def solve(req, feed):
+    """Returns the smallest (and among those, the lexicographically
+    first) list of feed types (numbered from 1) that together meet
+    the vitamin requirements, or None if there is none.
+
+    Subsets are tried in order of size, and within a size in
+    lexicographic order, so the first one that works is the answer.
+    Moving from one subset to the next adds or subtracts one feed
+    from a running vector of the vitamins still needed.
+    """
+    G = len(feed)
+    V = len(req)
+    needed = list(req)
+    chosen = []
+
+    def search(start, count):
+        if count == 0:
+            return all(n <= 0 for n in needed)
+        for feed_type in range(start, G - count + 1):
+            vits = feed[feed_type]
+            for j in range(V):
+                needed[j] -= vits[j]
+            chosen.append(feed_type + 1)
+            if search(feed_type + 1, count - 1):
+                return True
+            chosen.pop()
+            for j in range(V):
+                needed[j] += vits[j]
+        return False
+
+    for size in range(G + 1):
+        if search(0, size):
+            return chosen
+
+
 if __name__ == '__main__':
     main(open)
 else:
@@ -57,3 +74,37 @@ else:
 'holstein.out': """2 1 3
 """,
         })
+
+    def _solve_by_brute_force(req, feed):
+        best = None
+        for i in range(2 ** len(feed)):
+            feed_types = [t + 1 for t in range(len(feed)) if i >> t & 1]
+            vits = [
+                sum(feed[t - 1][j] for t in feed_types)
+                for j in range(len(req))
+            ]
+            if all(v >= r for v, r in zip(vits, req)):
+                key = (len(feed_types), feed_types)
+                if best is None or key < best:
+                    best = key
+        return None if best is None else best[1]
+
+    @test.case
+    def _random():
+        import random
+        rng = random.Random(2018)
+        for _ in range(200):
+            V = rng.randint(1, 5)
+            G = rng.randint(1, 8)
+            req = [rng.randint(1, 500) for _ in range(V)]
+            feed = [
+                tuple(rng.randint(0, 300) for _ in range(V))
+                for _ in range(G)
+            ]
+            test.equal(solve(req, feed), _solve_by_brute_force(req, feed))
+
+    @test.bench
+    def _bench_worst_case():
+        # 25 vitamins and 15 feeds (the largest input),
+        # where every feed is needed
+        solve([1000] * 25, [(1000 // 15 + 1,) * 25] * 15)
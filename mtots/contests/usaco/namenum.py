@@ -8,9 +8,9 @@ def main(open):
         numstr = f.read().strip()
 
     with open('dict.txt') as f:
-        names = tuple(line.strip() for line in f.read().strip().splitlines())
+        index = build_index(f.read().split())
 
-    matching_names = tuple(find_matching_names(numstr, names))
+    matching_names = index.get(numstr, ())
 
     with open('namenum.out', 'w') as f:
         if matching_names:
@@ -20,31 +20,46 @@ def main(open):
             f.write('NONE\n')
 
 
-def find_matching_names(numstr, names):
+# Q and Z are not on the keypad, so names containing them keep a letter
+# in their digit string, and never match any number.
+KEYPAD = str.maketrans({
+    ch: digit
+    for digit, chars in [
+        ('2', 'ABC'), ('3', 'DEF'), ('4', 'GHI'),
+        ('5', 'JKL'), ('6', 'MNO'), ('7', 'PRS'),
+        ('8', 'TUV'), ('9', 'WXY'),
+    ]
+    for ch in chars
+})
+
+
+def build_index(names):
+    """Maps the keypad digit string of every name to the list of names
+    with that digit string (in their original order)
+    """
+    index = {}
     for name in names:
-        if matches(numstr, name):
-            yield name
+        index.setdefault(name.translate(KEYPAD), []).append(name)
+    return index
+
 
+def find_all_matching_names(numstrs, index):
+    "Batch mode: answer many numbers against the same index"
+    return [tuple(index.get(numstr, ())) for numstr in numstrs]
 
-def matches(numstr, name):
-    return (
-        len(numstr) == len(name) and
-        all(matches_char(digit, ch) for digit, ch in zip(numstr, name))
-    )
 
+def dump_index(index, f):
+    "Persist an index, one digit string and its names per line"
+    for numstr, names in index.items():
+        f.write(numstr + ' ' + ' '.join(names) + '\n')
 
-def matches_char(digit, ch):
-    return ch in {
-        '1': set(),
-        '2': {'A', 'B', 'C'},
-        '3': {'D', 'E', 'F'},
-        '4': {'G', 'H', 'I'},
-        '5': {'J', 'K', 'L'},
-        '6': {'M', 'N', 'O'},
-        '7': {'P', 'R', 'S'},
-        '8': {'T', 'U', 'V'},
-        '9': {'W', 'X', 'Y'},
-    }[digit]
+
+def load_index(f):
+    index = {}
+    for line in f.read().splitlines():
+        numstr, *names = line.split()
+        index[numstr] = names
+    return index
 
 
 if __name__ == '__main__':
@@ -52,6 +67,7 @@ if __name__ == '__main__':
 else:
     from mtots import test
     from . import _testutil
+    import contextlib
 
     @test.case
     def _sample():
@@ -4680,3 +4696,29 @@ ZYTA
 'namenum.out': """GREG
 """,
         })
+
+    @test.case
+    def _index():
+        names = ['GREG', 'GREGG', 'HQ', 'IRFG', 'ZOE']
+        index = build_index(names)
+        test.equal(index['4734'], ['GREG', 'IRFG'])
+        test.equal(
+            find_all_matching_names(['4734', '47344', '1', '47'], index),
+            [('GREG', 'IRFG'), ('GREGG',), (), ()],
+        )
+
+        contents = {}
+
+        @contextlib.contextmanager
+        def open(name, mode='r'):
+            if mode == 'w':
+                fake_file = _testutil.FakeFile('w', '')
+                yield fake_file
+                contents[name] = fake_file.read()
+            else:
+                yield _testutil.FakeFile('r', contents[name])
+
+        with open('index.txt', 'w') as f:
+            dump_index(index, f)
+        with open('index.txt') as f:
+            test.equal(load_index(f), index)
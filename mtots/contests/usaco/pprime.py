@@ -17,36 +17,86 @@ def main(open):
 def solve(a, b):
 
     def generate_palindromes():
+        # Every palindrome with an even number of digits is a multiple
+        # of 11, so 11 is the only prime among them.
+        # The rest are generated in increasing order.
         D = len(str(b))
 
         for i in range(10):
             yield i
 
-        for i in range(10 ** (D // 2)):
-            istr = str(i)
-            value = int(istr + istr[::-1])
-            if value > b:
-                break
-            yield value
+        yield 11
+
+        for half_digits in range(1, (D - 1) // 2 + 1):
+            for i in range(10 ** (half_digits - 1), 10 ** half_digits):
+                istr = str(i)
+                rstr = istr[::-1]
+                for middle in '0123456789':
+                    value = int(istr + middle + rstr)
+                    if value > b:
+                        return
+                    yield value
+
+    candidates = sorted(x for x in generate_palindromes() if a <= x <= b)
+    return primes_among(candidates)
+
+
+def primes_among(candidates, segment_size=1 << 16):
+    """Returns the primes in the sorted list of candidates.
+
+    Instead of testing each candidate separately, sieves just the
+    segments of the range that contain candidates.
+    """
+    if not candidates:
+        return []
+    stop = candidates[-1] + 1
+    base_primes = [p for p, flag in enumerate(sieve(isqrt(stop) + 1)) if flag]
+    primes = []
+    i = 0
+    while i < len(candidates):
+        lo = candidates[i]
+        hi = min(lo + segment_size, stop)
+        flags = sieve_range(lo, hi, base_primes)
+        while i < len(candidates) and candidates[i] < hi:
+            if flags[candidates[i] - lo]:
+                primes.append(candidates[i])
+            i += 1
+    return primes
+
+
+def isqrt(n):
+    "largest r with r * r <= n, for n >= 0 (math.isqrt needs Python 3.8)"
+    if n == 0:
+        return 0
+    r = 1 << (n.bit_length() + 1) // 2
+    while True:
+        s = (r + n // r) // 2
+        if s >= r:
+            return r
+        r = s
 
-        for i in range(10 ** ((D - 1) // 2)):
-            istr = str(i)
-            rstr = istr[::-1]
-            for middle in range(10):
-                value = int(istr + str(middle) + rstr)
-                if value > b:
-                    return
-                yield value
 
-    def is_prime(x):
-        for p in range(2, int(x ** 0.5) + 1):
-            if x % p == 0:
-                return False
-        return True
+def sieve(limit):
+    "flags[n] == 1 iff n is prime, for 0 <= n < limit"
+    flags = bytearray([1]) * max(limit, 2)
+    flags[0] = flags[1] = 0
+    for p in range(2, isqrt(limit - 1) + 1 if limit > 1 else 0):
+        if flags[p]:
+            flags[p * p::p] = bytes(len(range(p * p, limit, p)))
+    return flags[:limit]
 
-    return sorted(
-        x for x in generate_palindromes() if x >= a and is_prime(x)
-    )
+
+def sieve_range(start, stop, base_primes):
+    "flags[n - start] == 1 iff n is prime, for start <= n < stop"
+    flags = bytearray([1]) * (stop - start)
+    for p in base_primes:
+        if p * p >= stop:
+            break
+        first = max(p * p, (start + p - 1) // p * p)
+        flags[first - start::p] = bytes(len(range(first, stop, p)))
+    for n in range(start, min(stop, 2)):
+        flags[n - start] = 0
+    return flags
 
 
 if __name__ == '__main__':
@@ -84,3 +134,37 @@ else:
         }, {
 'pprime.out': '',
         })
+
+    @test.case
+    def _primes_among():
+        from mtots.util import primes
+        candidates = list(range(0, 3000)) + list(range(10 ** 6, 10 ** 6 + 50))
+        test.equal(
+            primes_among(candidates, segment_size=100),
+            [n for n in candidates if primes.is_prime(n)],
+        )
+
+    @test.case
+    def _isqrt():
+        from mtots.util import primes
+        for n in list(range(2000)) + [10 ** 16 - 1, 10 ** 16, 2 ** 105]:
+            test.equal(isqrt(n), primes.isqrt(n))
+
+    @test.slow
+    def _large():
+        from mtots.util import primes
+        result = solve(5, 100000000)
+        palindromes = set(range(10))
+        for i in range(1, 10 ** 4):
+            istr = str(i)
+            palindromes.add(int(istr + istr[::-1]))
+            for middle in '0123456789':
+                palindromes.add(int(istr + middle + istr[::-1]))
+        test.equal(result, sorted(
+            x for x in palindromes
+            if 5 <= x <= 100000000 and primes.is_prime(x)
+        ))
+
+    @test.bench(repeat=5)
+    def _bench_large():
+        solve(5, 100000000)
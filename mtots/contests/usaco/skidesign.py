@@ -11,21 +11,53 @@ def main(open):
         N = int(next(lines))
         heights = [int(next(lines)) for _ in range(N)]
 
-    cost = min(compute_cost(heights, i) for i in range(100))
+    cost = solve(heights)
 
     with open('skidesign.out', 'w') as f:
         f.write(f'{cost}\n')
 
 
-def compute_cost(heights, min_height):
-    max_height = min_height + 17
-    cost = 0
+def solve(heights, max_diff=17):
+    """Returns the minimum cost of changing the heights so that the
+    highest and lowest hills differ by at most max_diff.
+
+    Changing a hill's height by x costs x ** 2, so every window
+    [lo, lo + max_diff] costs
+        sum((lo - h) ** 2 for h < lo) + sum((h - hi) ** 2 for h > hi)
+    which expands into counts, sums and sums of squares of the heights
+    below lo and above hi. With prefix sums of those over a histogram
+    of the heights, each window costs O(1), however many hills there are.
+    """
+    V = max(heights, default=0) + 1
+    histogram = [0] * V
     for height in heights:
-        if height < min_height:
-            cost += (min_height - height) ** 2
-        elif height > max_height:
-            cost += (height - max_height) ** 2
-    return cost
+        histogram[height] += 1
+
+    # count[x], total[x] and squares[x] are over the heights below x
+    count = [0] * (V + 1)
+    total = [0] * (V + 1)
+    squares = [0] * (V + 1)
+    for x in range(V):
+        k = histogram[x]
+        count[x + 1] = count[x] + k
+        total[x + 1] = total[x] + k * x
+        squares[x + 1] = squares[x] + k * x * x
+
+    best = None
+    for lo in range(max(V - 1 - max_diff, 0) + 1):
+        hi = lo + max_diff
+        cost = lo * lo * count[lo] - 2 * lo * total[lo] + squares[lo]
+        if hi + 1 < V:
+            above_count = count[V] - count[hi + 1]
+            above_total = total[V] - total[hi + 1]
+            above_squares = squares[V] - squares[hi + 1]
+            cost += (
+                above_squares - 2 * hi * above_total +
+                hi * hi * above_count
+            )
+        if best is None or cost < best:
+            best = cost
+    return best
 
 
 if __name__ == '__main__':
@@ -89,8 +121,33 @@ class FakeFile:
         return ''.join(self.contents)
 
 
+def _random():
+    from mtots import test
+    import random
+    rng = random.Random(17)
+
+    def solve_by_brute_force(heights, max_diff):
+        return min(
+            sum((lo - h) ** 2 for h in heights if h < lo) +
+            sum((h - lo - max_diff) ** 2 for h in heights
+                if h > lo + max_diff)
+            for lo in range(101)
+        )
+
+    for _ in range(100):
+        heights = [
+            rng.randint(0, 100) for _ in range(rng.randint(1, 30))
+        ]
+        max_diff = rng.choice([0, 1, 17, 50, 100])
+        test.equal(
+            solve(heights, max_diff),
+            solve_by_brute_force(heights, max_diff),
+        )
+
+
 try:
     import mtots.test
     mtots.test.case(_sample)
+    mtots.test.case(_random)
 except ImportError:
     pass
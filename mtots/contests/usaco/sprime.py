@@ -27,15 +27,38 @@ def solve(N):
                     if is_prime(n * 10 + digit)
             )
 
-    def is_prime(n):
-        for p in range(2, int(n ** 0.5) + 1):
-            if n % p == 0:
-                return False
-        return True
-
     return recurse(N)
 
 
+# Deterministic for all n < 3.3 * 10 ** 24, which covers 64-bit ints
+MILLER_RABIN_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+
+def is_prime(n):
+    "Deterministic Miller-Rabin"
+    if n < 2:
+        return False
+    for p in MILLER_RABIN_BASES:
+        if n % p == 0:
+            return n == p
+    d = n - 1
+    s = 0
+    while d & 1 == 0:
+        d >>= 1
+        s += 1
+    for a in MILLER_RABIN_BASES:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
 if __name__ == '__main__':
     main(open)
 else:
@@ -66,3 +89,23 @@ else:
 7393
 """,
         })
+
+    @test.case
+    def _is_prime():
+        from mtots.util import primes
+        flags = primes.sieve(10 ** 5)
+        test.equal(
+            [n for n in range(10 ** 5) if is_prime(n)],
+            [n for n in range(10 ** 5) if flags[n]],
+        )
+
+    @test.slow
+    def _large():
+        test.equal(
+            list(solve(8)),
+            [23399339, 29399999, 37337999, 59393339, 73939133],
+        )
+
+    @test.bench
+    def _bench_large():
+        list(solve(8))
@@ -3,8 +3,6 @@ ID: math4to3
 TASK: wormhole
 LANG: PYTHON3
 """
-import itertools
-
 
 def main(open):
     with open('wormhole.in') as f:
@@ -14,93 +12,79 @@ def main(open):
         for _ in range(N):
             coordinates.append(tuple(map(int, next(lines).split())))
 
-    total = 0
-    physical_mapping = compute_physical_mapping(coordinates)
-    for wormhole_mapping in enumerate_all_wormhole_mappings(N):
-        if check_pairings(N, physical_mapping, wormhole_mapping):
-            total += 1
+    total = count_pairings_with_cycles(compute_physical_mapping(coordinates))
 
     with open('wormhole.out', 'w') as f:
         f.write(f'{total}\n')
 
 
-def check_pairings(N, physical_mapping, wormhole_mapping):
-    mappings = [physical_mapping, wormhole_mapping]
-    cache = dict()
-
-    def escapes(state, stack=None):
-        if state not in cache:
-            i, bit = state
-            stack = set() if stack is None else stack
-            mapping = mappings[bit]
-            if state in stack:
-                cache[state] = False
-            elif mapping[i] is None:
-                cache[state] = True
-            else:
-                stack.add(state)
-                cache[state] = escapes((mapping[i], 1 - bit), stack)
-                stack.remove(state)
-        return cache[state]
-
-    return any(not escapes((i, bit)) for i in range(N) for bit in range(2))
-
-
-def compute_physical_mapping(coordinates):
-    mapping = {}
-
-    for i in range(len(coordinates)):
-        mapped = None
-        xi, yi = coordinates[i]
-        for j, (xj, yj) in enumerate(coordinates):
-            if i == j:
-                continue
-            xm = None if mapped is None else coordinates[mapped][0]
-            if yi == yj and xi < xj and (xm is None or xj < xm):
-                mapped = j
-        mapping[i] = mapped
-
-    return mapping
-
+def count_pairings_with_cycles(physical_mapping):
+    """Counts the pairings of wormholes in which Bessie can get stuck.
 
-def enumerate_all_wormhole_mappings(N):
-    I = compute_pairings_count(N)
-    for i in range(I):
-        remaining = 2 ** N - 1
-        mapping = {}
-        modulo = N - 1
-        while remaining:
-            a, b = find_next_pair(N, remaining, i % modulo)
-            mapping[a] = b
-            mapping[b] = a
-            remaining ^= 1 << a
-            remaining ^= 1 << b
-            i //= modulo
-            modulo -= 2
-        yield mapping
+    physical_mapping[i] is the wormhole that Bessie walks into after
+    coming out of wormhole i, or -1 if there is none.
 
+    Pairings are built up one pair at a time (always pairing the lowest
+    unpaired wormhole), and as soon as a partial pairing has a cycle,
+    all of its completions are counted without enumerating them.
+    """
+    N = len(physical_mapping)
+    partner = [-1] * N
 
-def find_next_pair(N, remaining, choice):
-    a = find_next_live_bit(remaining, 0)
-    b = find_next_live_bit(remaining, a + 1)
-    for _ in range(choice):
-        b = find_next_live_bit(remaining, b + 1)
-    return a, b
+    # pairings_count[m] = number of ways to pair up m wormholes
+    pairings_count = [1] * (N + 1)
+    for m in range(2, N + 1, 2):
+        pairings_count[m] = pairings_count[m - 2] * (m - 1)
 
-
-def find_next_live_bit(remaining, i):
-    while not (remaining & (1 << i)):
-        i += 1
-    return i
+    def has_cycle_through(start):
+        # Follow Bessie from coming out of wormhole start.
+        # Only called right after pairing start, when there were no
+        # cycles before, so any cycle found must go through start.
+        i = start
+        for _ in range(N):
+            entered = physical_mapping[i]
+            if entered < 0:
+                return False
+            i = partner[entered]
+            if i < 0:
+                return False
+            if i == start:
+                return True
+        return False
+
+    def count(unpaired_count):
+        if unpaired_count == 0:
+            return 0
+        a = partner.index(-1)
+        total = 0
+        for b in range(a + 1, N):
+            if partner[b] < 0:
+                partner[a] = b
+                partner[b] = a
+                if has_cycle_through(a) or has_cycle_through(b):
+                    total += pairings_count[unpaired_count - 2]
+                else:
+                    total += count(unpaired_count - 2)
+                partner[a] = -1
+                partner[b] = -1
+        return total
+
+    return count(N)
 
 
-def compute_pairings_count(N):
-    assert N % 2 == 0, N
-    c = 1
-    while N > 2:
-        c *= N - 1
-        N -= 2
-    return c
+def compute_physical_mapping(coordinates):
+    """For each wormhole, the index of the next wormhole to its right
+    on the same row (i.e. with the same y), or -1 if there is none
+    """
+    mapping = [-1] * len(coordinates)
+    order = sorted(
+        range(len(coordinates)),
+        key=lambda i: (coordinates[i][1], coordinates[i][0]),
+    )
+    for i, j in zip(order, order[1:]):
+        if coordinates[i][1] == coordinates[j][1]:
+            mapping[i] = j
+    return mapping
 
 
 if __name__ == '__main__':
@@ -184,9 +168,77 @@ class FakeFile:
         return ''.join(self.contents)
 
 
+def _count_by_brute_force(coordinates):
+    N = len(coordinates)
+    physical_mapping = compute_physical_mapping(coordinates)
+
+    def pairings(unpaired):
+        if not unpaired:
+            yield []
+            return
+        a = unpaired[0]
+        for b in unpaired[1:]:
+            rest = [i for i in unpaired if i != a and i != b]
+            for pairs in pairings(rest):
+                yield [(a, b)] + pairs
+
+    def gets_stuck(partner, start):
+        i = start
+        for _ in range(N + 1):
+            entered = physical_mapping[i]
+            if entered < 0:
+                return False
+            i = partner[entered]
+        return True
+
+    total = 0
+    for pairs in pairings(list(range(N))):
+        partner = [None] * N
+        for a, b in pairs:
+            partner[a] = b
+            partner[b] = a
+        total += any(gets_stuck(partner, i) for i in range(N))
+    return total
+
+
+def _random():
+    from mtots import test
+    import random
+    rng = random.Random(1337)
+    for _ in range(100):
+        N = rng.choice([2, 4, 6, 8])
+        coordinates = list({
+            (rng.randint(0, 4), rng.randint(0, 2)) for _ in range(N * 2)
+        })[:N]
+        if len(coordinates) == N:
+            test.equal(
+                count_pairings_with_cycles(
+                    compute_physical_mapping(coordinates)),
+                _count_by_brute_force(coordinates),
+            )
+
+
+def _n12():
+    from mtots import test
+    # All 12 wormholes on the same row
+    coordinates = [(x, 0) for x in range(12)]
+    test.equal(
+        count_pairings_with_cycles(compute_physical_mapping(coordinates)),
+        8910,
+    )
+
+
+def _bench_n12():
+    coordinates = [(x, 0) for x in range(12)]
+    count_pairings_with_cycles(compute_physical_mapping(coordinates))
+
+
 try:
     import mtots.test
     mtots.test.case(_sample)
-    mtots.test.slow(_another_test)
+    mtots.test.case(_another_test)
+    mtots.test.case(_random)
+    mtots.test.case(_n12)
+    mtots.test.bench(_bench_n12)
 except ImportError:
     pass
@@ -1,47 +1,135 @@
 """
 mtots module finder.
 Finds all modules under a particular package in mtots.
-We can't really write tests for this because the testing
-mechanism depends on this module.
+The testing mechanism depends on this module, so its tests
+live in mtots.test along with those of the test runner.
+
+Directory listings can optionally be cached in an index file.
+Each cached listing is keyed by the directory's path and is reused
+as long as the directory's mtime has not changed (adding, removing
+or renaming an entry changes the mtime of the directory containing it).
+This saves most of the file system calls on slow (e.g. network)
+file systems, where even a single stat per entry adds up.
 """
 import os
 
 
 mtots_dir = os.path.dirname(os.path.realpath(__file__))
 
+_INDEX_VERSION = 1
 
-def _find_modules(*, pkg, path):
-    if os.path.isfile(path + '.py'):
-        yield pkg
-    elif os.path.isdir(path):
-        for name in os.listdir(path):
+
+def _list_directory(path):
+    """Returns a (module names, subdirectory names) pair for the
+    directory at path, skipping private and hidden entries.
+    """
+    modules = []
+    directories = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            name = entry.name
             if name.startswith(('.', '_')):
                 continue
-
             if name.endswith('.py'):
                 basename = name[:-len('.py')]
-            else:
-                basename = name
+                if '.' not in basename and entry.is_file():
+                    modules.append(basename)
+            elif '.' not in name and entry.is_dir():
+                directories.append(name)
+    return modules, directories
 
-            if '.' in basename:
-                continue
 
+class _Index:
+    def __init__(self, path):
+        self.path = path
+        self.listings = {}
+        self.dirty = False
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        import json
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == _INDEX_VERSION:
+            self.listings = data['listings']
+
+    def save(self):
+        import json
+        if self.path is None or not self.dirty:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(
+                {'version': _INDEX_VERSION, 'listings': self.listings},
+                f,
+            )
+        os.replace(tmp_path, self.path)
+
+    def list_directory(self, path):
+        if self.path is None:
+            return _list_directory(path)
+        mtime_ns = os.stat(path).st_mtime_ns
+        listing = self.listings.get(path)
+        if listing is None or listing[0] != mtime_ns:
+            listing = [mtime_ns, *_list_directory(path)]
+            self.listings[path] = listing
+            self.dirty = True
+        return listing[1], listing[2]
+
+
+def _find_modules(*, pkg, path, exclude, index):
+    if pkg in exclude:
+        return
+    modules, directories = index.list_directory(path)
+    for basename in modules:
+        if f'{pkg}.{basename}' not in exclude:
+            yield f'{pkg}.{basename}'
+    for basename in directories:
+        if basename not in modules:
             yield from _find_modules(
                 pkg=f'{pkg}.{basename}',
                 path=os.path.join(path, basename),
+                exclude=exclude,
+                index=index,
             )
 
 
-def _find_mtots_modules_iter(pkg):
+def _find_mtots_modules_iter(pkg, exclude, index):
     if pkg == 'mtots':
-        yield from _find_modules(pkg=pkg, path=mtots_dir)
+        path = mtots_dir
     elif pkg.startswith('mtots.'):
         relpath = pkg[len('mtots.'):].replace('.', os.path.sep)
-        abspath = os.path.join(mtots_dir, relpath)
-        yield from _find_modules(pkg=pkg, path=abspath)
+        path = os.path.join(mtots_dir, relpath)
     else:
         raise TypeError(f'Expected a pkg under mtots but got {pkg}')
+    if os.path.isfile(path + '.py'):
+        if pkg not in exclude:
+            yield pkg
+    elif os.path.isdir(path):
+        yield from _find_modules(
+            pkg=pkg,
+            path=path,
+            exclude=exclude,
+            index=index,
+        )
+
 
+def find(pkg, *, exclude=(), index_path=None):
+    """Find all modules under pkg, in sorted order.
 
-def find(pkg):
-    return tuple(sorted(_find_mtots_modules_iter(pkg)))
+    Modules in exclude, and all modules in packages in exclude,
+    are skipped.
+    If index_path is given, directory listings are cached there.
+    """
+    index = _Index(index_path)
+    modules = tuple(sorted(_find_mtots_modules_iter(
+        pkg,
+        frozenset(exclude),
+        index,
+    )))
+    index.save()
+    return modules
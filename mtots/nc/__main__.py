@@ -1,17 +1,56 @@
-from . import cxx
-from . import resolver
 import argparse
 import sys
 
 
 def main():
     parser = argparse.ArgumentParser(prog='mtots.text.nc')
-    parser.add_argument('path')
+    parser.add_argument('path', nargs='?')
+    parser.add_argument(
+        '--serve',
+        default=False,
+        action='store_true',
+        help='Start a compiler daemon that keeps caches warm',
+    )
+    parser.add_argument(
+        '--client',
+        default=False,
+        action='store_true',
+        help='Forward the compile request to a running compiler daemon',
+    )
+    parser.add_argument(
+        '--socket',
+        default=None,
+        help='Path of the Unix domain socket used by --serve/--client',
+    )
     args = parser.parse_args()
-    with open(args.path) as f:
-        data = f.read()
-    node = resolver.load(data, path=args.path)
-    sys.stdout.write(f'{cxx.render(node)}')
+
+    # NOTE: The compiler modules are imported lazily so that
+    # '--client' does not have to pay for building the grammar.
+    from . import daemon
+    socket_path = args.socket or daemon.DEFAULT_SOCKET_PATH
+
+    if args.serve:
+        daemon.serve(socket_path)
+        return
+
+    if args.path is None:
+        parser.error('path is required unless --serve is set')
+
+    if args.client:
+        with open(args.path) as f:
+            data = f.read()
+        try:
+            output = daemon.request_compile(
+                data,
+                path=args.path,
+                socket_path=socket_path,
+            )
+        except daemon.DaemonError as e:
+            sys.stderr.write(f'{e}\n')
+            sys.exit(1)
+    else:
+        output = daemon.compile_path(args.path)
+    sys.stdout.write(output)
 
 
 if __name__ == '__main__':
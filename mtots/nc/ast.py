@@ -5,6 +5,7 @@ from mtots.parser import base
 from mtots.util import dataclasses
 from mtots.util import typing
 from mtots.util.dataclasses import dataclass
+import weakref
 
 
 class Type:
@@ -15,8 +16,17 @@ class Type:
 @typing.enforce
 @dataclass(frozen=True)
 class PrimitiveType(Type):
+    """Primitive types are singletons (see VOID, BOOL, etc. below),
+    so like all other types they compare by identity.
+    """
     name: str
 
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return id(self)
+
     def __str__(self):
         return f'(primitive-type {self.name})'
 
@@ -39,6 +49,33 @@ def apply_reified_bindings(*, type, bindings):
     return _apply_reified_bindings(type, bindings)
 
 
+def instantiate_function(*, function, type_arguments):
+    """Returns the FunctionSignature of a generic function
+    with the given type arguments substituted in.
+
+    Signatures are memoized per function, so every call site that
+    uses the same type arguments shares the same signature (and
+    the same parameter and return type objects).
+    """
+    instantiations = function.instantiations
+    if type_arguments not in instantiations:
+        bindings = get_reified_bindings(
+            type_parameters=function.type_parameters,
+            type_arguments=type_arguments,
+        )
+        instantiations[type_arguments] = FunctionSignature(
+            parameter_types=tuple(
+                apply_reified_bindings(type=param.type, bindings=bindings)
+                for param in function.parameters
+            ),
+            return_type=apply_reified_bindings(
+                type=function.return_type,
+                bindings=bindings,
+            ),
+        )
+    return instantiations[type_arguments]
+
+
 class BaseVariableDeclaration:
     pass
 
@@ -110,6 +147,18 @@ class Function(Markable):
     parameters: typing.List[Parameter]
     body: typing.Optional[Expression]
 
+    # type_arguments -> FunctionSignature
+    # (see instantiate_function)
+    instantiations: typing.Dict[tuple, 'FunctionSignature'] = (
+        dataclasses.field(default_factory=dict, repr=False, compare=False)
+    )
+
+
+@dataclass(frozen=True)
+class FunctionSignature:
+    parameter_types: typing.Tuple[Type, ...]
+    return_type: Type
+
 
 @typing.enforce
 @dataclass
@@ -150,50 +199,98 @@ class Class(Type, Markable):
         return self is other
 
     def __hash__(self):
-        return hash(self)
+        return id(self)
 
     def __str__(self):
         return f'(class {self.name})'
 
 
+# (class_, type_arguments) -> ReifiedType
+# (see ReifiedType.intern)
+_reified_types = weakref.WeakValueDictionary()
+
+
 @typing.enforce
 @dataclass(frozen=True)
 class ReifiedType(Type, base.Node):
+    """A generic class with all of its type arguments filled in.
+
+    Always create these with ReifiedType.intern, so that there is
+    exactly one ReifiedType for every distinct combination of
+    class_ and type_arguments. That way, like all other types,
+    ReifiedTypes can be compared by identity and hashed in O(1).
+    """
     class_: Class
     type_arguments: typing.Tuple[Type, ...]
 
     _base = None
     _bindings = None
     _all_fields = None
+    _all_methods = None
+
+    @staticmethod
+    def intern(*, mark, class_, type_arguments):
+        """Returns the unique ReifiedType for the given class and
+        type arguments.
+        If the type already exists, the given mark is ignored,
+        and the mark of the type's first occurrence is kept.
+        """
+        key = (class_, type_arguments)
+        reified_type = _reified_types.get(key)
+        if reified_type is None:
+            reified_type = ReifiedType(
+                mark=mark,
+                class_=class_,
+                type_arguments=type_arguments,
+            )
+            _reified_types[key] = reified_type
+        return reified_type
+
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return id(self)
+
+    def __str__(self):
+        return (
+            f'(reified-type {self.class_.name} '
+            f'[{", ".join(map(str, self.type_arguments))}])'
+        )
 
     def usable_as(self, other):
         return (
             isinstance(other, (ReifiedType, Class)) and
-            (self == other or
-                other.base is not None and self.usable_as(other.base))
+            (self is other or
+                self.base is not None and self.base.usable_as(other))
         )
 
+    @property
+    def inheritable(self):
+        return self.class_.inheritable
+
+    @property
+    def name(self):
+        return self.class_.name
+
     @property
     def base(self):
-        if self._base is None:
-            if self.class_.base is not None:
-                bindings = get_reified_bindings(
-                    type_parameters=self.class_.type_parameters,
-                    type_arguments=self.type_arguments,
-                )
-                self._base = apply_reified_bindings(
-                    type=self.class_.base,
-                    bindings=bindings,
-                )
+        # Since ReifiedType is frozen, lazily computed values
+        # have to be set with object.__setattr__
+        if self._base is None and self.class_.base is not None:
+            object.__setattr__(self, '_base', apply_reified_bindings(
+                type=self.class_.base,
+                bindings=self.bindings,
+            ))
         return self._base
 
     @property
     def bindings(self):
         if self._bindings is None:
-            self._bindings = get_reified_bindings(
-                type_parameters=type_.class_.type_parameters,
-                type_arguments=type_.type_arguments,
-            )
+            object.__setattr__(self, '_bindings', get_reified_bindings(
+                type_parameters=self.class_.type_parameters,
+                type_arguments=self.type_arguments,
+            ))
         return self._bindings
 
     @property
@@ -201,18 +298,16 @@ class ReifiedType(Type, base.Node):
         if self._all_fields is None:
             field_map = {}
             bindings = self.bindings
-            for key, raw_field in class_.all_fields.items():
-                field_type = apply_reified_bindings(
-                    type=raw_field.type,
-                    bindings=bindings,
-                )
-                field = Field(
+            for key, raw_field in self.class_.all_fields.items():
+                field_map[key] = Field(
                     mark=raw_field.mark,
-                    type=field_type,
+                    type=apply_reified_bindings(
+                        type=raw_field.type,
+                        bindings=bindings,
+                    ),
                     name=raw_field.name,
                 )
-                field_map[key] = raw_field
-            self._all_fields = field_map
+            object.__setattr__(self, '_all_fields', field_map)
         return self._all_fields
 
     @property
@@ -220,7 +315,7 @@ class ReifiedType(Type, base.Node):
         if self._all_methods is None:
             methods_map = {}
             bindings = self.bindings
-            for key, raw_method in class_.all_methods.items():
+            for key, raw_method in self.class_.all_methods.items():
                 parameters = []
                 for raw_parameter in raw_method.parameters:
                     parameters.append(Parameter(
@@ -237,7 +332,7 @@ class ReifiedType(Type, base.Node):
                     scope=raw_method.scope,
                     abstract=raw_method.abstract,
                     return_type=apply_reified_bindings(
-                        type=raw_method.type,
+                        type=raw_method.return_type,
                         bindings=bindings,
                     ),
                     name=raw_method.name,
@@ -245,7 +340,7 @@ class ReifiedType(Type, base.Node):
                     body=None,
                 )
                 methods_map[method.name] = method
-            self._all_methods = methods_map
+            object.__setattr__(self, '_all_methods', methods_map)
         return self._all_methods
 
 ##############################################################################
@@ -322,13 +417,13 @@ def _apply_reified_bindings(on):
 
     @on(ReifiedType)
     def r(type_, bindings):
-        return ReifiedType(
+        return ReifiedType.intern(
             mark=type_.mark,
             class_=type_.class_,
-            type_arguments=[
+            type_arguments=tuple(
                 _apply_reified_bindings(t, bindings)
                 for t in type_.type_arguments
-            ],
+            ),
         )
 
     @on(TypeParameter)
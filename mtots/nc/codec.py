@@ -0,0 +1,546 @@
+"""Compact binary serialization for nc CST trees
+
+Used for sharing parse results between processes and caching them
+on disk without going through pickle.
+
+The format is driven by the dataclass field lists of the node classes
+in nc.cst. Strings, ints and floats are stored once each in constant
+tables, and every Source is stored once in a source table.
+
+Decoding builds a single list of objects: None, False, True and (), then
+the constants, then the sources, and then the nodes and tuples of the
+tree in post-order. Every node or tuple is a record of indices into
+the objects built before it:
+
+    marked node:    node-type tag, source index, start, end,
+                    main + 1 (0 for None), one index per field
+    unmarked node:  node-type tag + len(_NODE_TYPES), one index per field
+    short tuple:    _TUPLE_TAG + length, one index per item
+    long tuple:     _TUPLE_TAG, length, one index per item
+
+so each record is decoded by a single call to a builder precomputed for
+its node type, without any per-value dispatch.
+
+Everything except string contents is stored in flat arrays of
+little-endian numbers, so that decoding the arrays themselves happens
+in C. All unsigned arrays use the smallest item size that fits:
+
+    MAGIC, schema hash (4 bytes)
+    header: unsigned item size, the size of each section and the index
+            of the root object
+    string lengths (in code points)
+    big ints (string index each)
+    sources (pairs): path string index, data string index
+    records
+    all strings as one utf-8 blob
+    ints (int64 each)
+    floats (float64 each)
+
+Only nc.cst nodes are supported: AST nodes refer to resolver scopes
+and to mutable (and cyclic) class and function objects, so they
+are better rebuilt by running the resolver on a decoded CST.
+"""
+from . import cst
+from mtots import test
+from mtots.parser import base
+from mtots.util.memoizer import memoize
+import array
+import itertools
+import struct
+import sys
+import zlib
+
+
+MAGIC = b'NCST\x03'
+
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+
+# item size, #strings, #string bytes, #ints, #floats, #big ints,
+# #sources, #record codes, root index
+_HEADER = struct.Struct('<B8Q')
+
+# Floats are stored (and deduplicated) by their encoding rather than
+# their value, since -0.0 == 0.0 (and nan != nan)
+_FLOAT64 = struct.Struct('<d')
+
+# Object indices of the values that every blob starts with
+_NONE_INDEX = 0
+_FALSE_INDEX = 1
+_TRUE_INDEX = 2
+_EMPTY_TUPLE_INDEX = 3
+_FIRST_CONSTANT_INDEX = 4
+
+_UNSIGNED_TYPECODES = {}
+for _typecode in 'QLIHB':
+    _UNSIGNED_TYPECODES[array.array(_typecode).itemsize] = _typecode
+
+
+class CodecError(Exception):
+    pass
+
+
+def _compute_schema():
+    node_types = []
+    for value in vars(cst).values():
+        if (isinstance(value, type) and
+                issubclass(value, cst.Node) and
+                '__dataclass_fields__' in vars(value)):
+            node_types.append(value)
+    field_names = tuple(
+        tuple(
+            field_name for field_name in node_type.__dataclass_fields__
+            if field_name != 'mark'
+        )
+        for node_type in node_types
+    )
+    schema_description = repr([
+        (node_type.__name__, names)
+        for node_type, names in zip(node_types, field_names)
+    ])
+    schema_hash = struct.pack(
+        '<I',
+        zlib.crc32(schema_description.encode('utf-8')),
+    )
+    return tuple(node_types), field_names, schema_hash
+
+
+_NODE_TYPES, _FIELD_NAMES, _SCHEMA_HASH = _compute_schema()
+_NODE_TAGS = {node_type: i for i, node_type in enumerate(_NODE_TYPES)}
+_UNMARKED_TAG_OFFSET = len(_NODE_TYPES)
+_TUPLE_TAG = 2 * len(_NODE_TYPES)
+
+# Tuples up to this length have their own builders, without a length code
+_MAX_SHORT_TUPLE_LENGTH = 4
+
+
+def _make_node_builder(node_type, field_names, *, marked):
+    """Returns a function that decodes one record of node_type.
+
+    It takes the objects decoded so far, the record codes, and the
+    index of the record's first code after its tag, appends the node
+    to the objects, and returns the index of the next record.
+
+    Nodes (and marks) are frozen, and were already validated when they
+    were serialized, so __init__ is skipped and the instance dicts are
+    filled in directly.
+    """
+    lines = ['def build(o, c, i):']
+    if marked:
+        lines += [
+            '    mark = new(Mark)',
+            '    main = c[i + 3]',
+            '    mark.__dict__.update(source=o[c[i]], start=c[i + 1], '
+            'end=c[i + 2], main=main - 1 if main else None)',
+        ]
+        first = 4
+    else:
+        lines.append('    mark = None')
+        first = 0
+    items = ''.join(
+        f', {name}=o[c[i + {first + j}]]'
+        for j, name in enumerate(field_names)
+    )
+    lines += [
+        '    node = new(node_type)',
+        f'    node.__dict__.update(mark=mark{items})',
+        '    o.append(node)',
+        f'    return i + {first + len(field_names)}',
+    ]
+    namespace = {
+        'new': object.__new__,
+        'Mark': base.Mark,
+        'node_type': node_type,
+    }
+    exec('\n'.join(lines), namespace)
+    return namespace['build']
+
+
+def _build_tuple(o, c, i):
+    end = i + 1 + c[i]
+    o.append(tuple(map(o.__getitem__, c[i + 1:end])))
+    return end
+
+
+def _make_short_tuple_builder(length):
+    items = ''.join(f'o[c[i + {j}]], ' for j in range(length))
+    namespace = {}
+    exec(
+        f'def build(o, c, i):\n'
+        f'    o.append(({items}))\n'
+        f'    return i + {length}\n',
+        namespace,
+    )
+    return namespace['build']
+
+
+_BUILDERS = tuple(
+    _make_node_builder(node_type, field_names, marked=marked)
+    for marked in (True, False)
+    for node_type, field_names in zip(_NODE_TYPES, _FIELD_NAMES)
+) + (_build_tuple,) + tuple(
+    _make_short_tuple_builder(length)
+    for length in range(1, _MAX_SHORT_TUPLE_LENGTH + 1)
+)
+
+
+def _unsigned_typecode(values):
+    largest = max(values, default=0)
+    for itemsize in (1, 2, 4, 8):
+        if largest < 1 << (8 * itemsize):
+            return _UNSIGNED_TYPECODES[itemsize]
+    raise CodecError(f'Value too large to serialize ({largest})')
+
+
+def _array_to_bytes(typecode, values):
+    arr = array.array(typecode, values)
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _array_from_bytes(typecode, data, start, count):
+    arr = array.array(typecode)
+    end = start + count * arr.itemsize
+    if end > len(data):
+        raise CodecError('Truncated nc CST blob')
+    arr.frombytes(data[start:end])
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr, end
+
+
+# Sections of the object list, in order (see _Encoder.finish)
+_STRINGS = 0
+_INTS = 1
+_FLOATS = 2
+_BIGINTS = 3
+_SOURCES = 4
+_RECORDS = 5
+
+
+class _Encoder:
+    def __init__(self):
+        # Records, where references to objects are (section, index)
+        # pairs until they are resolved in finish
+        self.codes = []
+        self.constants = [{}, {}, {}, {}]
+        self.sources = []
+        self.source_indices = {}
+        self.record_count = 0
+
+    def constant(self, section, value):
+        table = self.constants[section]
+        index = table.get(value)
+        if index is None:
+            index = table[value] = len(table)
+        return (section, index)
+
+    def string_index(self, s):
+        return self.constant(_STRINGS, s)[1]
+
+    def source(self, source):
+        index = self.source_indices.get(id(source))
+        if index is None:
+            if source.metadata is not None:
+                raise CodecError(f'Source metadata is not serializable')
+            index = len(self.sources) // 2
+            self.source_indices[id(source)] = index
+            self.sources.append(self.string_index(source.path))
+            self.sources.append(self.string_index(source.text))
+        return (_SOURCES, index)
+
+    def record(self, codes):
+        self.codes.extend(codes)
+        self.record_count += 1
+        return (_RECORDS, self.record_count - 1)
+
+    def value(self, value):
+        """Returns a reference to the encoded value"""
+        if value is None:
+            return _NONE_INDEX
+        elif value is False:
+            return _FALSE_INDEX
+        elif value is True:
+            return _TRUE_INDEX
+        elif type(value) is str:
+            return self.constant(_STRINGS, value)
+        elif type(value) is int:
+            if _INT64_MIN <= value <= _INT64_MAX:
+                return self.constant(_INTS, value)
+            return self.constant(_BIGINTS, self.string_index(str(value)))
+        elif type(value) is float:
+            return self.constant(_FLOATS, _FLOAT64.pack(value))
+        elif type(value) is tuple:
+            if not value:
+                return _EMPTY_TUPLE_INDEX
+            items = [self.value(item) for item in value]
+            if len(items) <= _MAX_SHORT_TUPLE_LENGTH:
+                return self.record([_TUPLE_TAG + len(items), *items])
+            return self.record([_TUPLE_TAG, len(items), *items])
+        elif type(value) in _NODE_TAGS:
+            tag = _NODE_TAGS[type(value)]
+            mark = value.mark
+            fields = [
+                self.value(getattr(value, field_name))
+                for field_name in _FIELD_NAMES[tag]
+            ]
+            if mark is None:
+                return self.record([tag + _UNMARKED_TAG_OFFSET, *fields])
+            return self.record([
+                tag,
+                self.source(mark.source),
+                mark.start,
+                mark.end,
+                0 if mark.main is None else mark.main + 1,
+                *fields,
+            ])
+        else:
+            raise CodecError(f'Cannot serialize {repr(value)}')
+
+    def finish(self, root):
+        strings, ints, floats, bigints = (
+            list(table) for table in self.constants
+        )
+        offsets = [_FIRST_CONSTANT_INDEX]
+        for size in (
+                len(strings),
+                len(ints),
+                len(floats),
+                len(bigints),
+                len(self.sources) // 2):
+            offsets.append(offsets[-1] + size)
+
+        def resolve(ref):
+            return ref if type(ref) is int else offsets[ref[0]] + ref[1]
+
+        codes = [resolve(code) for code in self.codes]
+        unsigned = [
+            *(len(s) for s in strings),
+            *bigints,
+            *self.sources,
+            *codes,
+        ]
+        typecode = _unsigned_typecode(unsigned)
+        encoded_strings = ''.join(strings).encode('utf-8')
+        return b''.join([
+            MAGIC,
+            _SCHEMA_HASH,
+            _HEADER.pack(
+                array.array(typecode).itemsize,
+                len(strings),
+                len(encoded_strings),
+                len(ints),
+                len(floats),
+                len(bigints),
+                len(self.sources) // 2,
+                len(codes),
+                resolve(root),
+            ),
+            _array_to_bytes(typecode, unsigned),
+            encoded_strings,
+            _array_to_bytes('q', ints),
+            b''.join(floats),
+        ])
+
+
+def _decode(data):
+    if not data.startswith(MAGIC):
+        raise CodecError('Not an nc CST blob')
+    i = len(MAGIC) + len(_SCHEMA_HASH)
+    if data[len(MAGIC):i] != _SCHEMA_HASH:
+        raise CodecError('nc CST blob was written with another schema')
+    if len(data) < i + _HEADER.size:
+        raise CodecError('Truncated nc CST blob')
+    (
+        itemsize, string_count, string_byte_count,
+        int_count, float_count, bigint_count,
+        source_count, code_count, root,
+    ) = _HEADER.unpack_from(data, i)
+    i += _HEADER.size
+    typecode = _UNSIGNED_TYPECODES.get(itemsize)
+    if typecode is None:
+        raise CodecError(f'Invalid item size {itemsize}')
+
+    # All the unsigned sections are read as a single array
+    unsigned, i = _array_from_bytes(
+        typecode,
+        data,
+        i,
+        string_count + bigint_count + source_count * 2 + code_count,
+    )
+    unsigned = unsigned.tolist()
+    j = string_count + bigint_count
+    string_lengths = unsigned[:string_count]
+    bigints = unsigned[string_count:j]
+    sources = unsigned[j:j + source_count * 2]
+    codes = unsigned[j + source_count * 2:]
+
+    if i + string_byte_count > len(data):
+        raise CodecError('Truncated nc CST blob')
+    # Decoding all strings at once and slicing the result is much
+    # faster than decoding them one at a time.
+    text = data[i:i + string_byte_count].decode('utf-8')
+    i += string_byte_count
+    starts = [0, *itertools.accumulate(string_lengths)]
+    strings = list(map(text.__getitem__, map(slice, starts, starts[1:])))
+    objects = [None, False, True, (), *strings]
+
+    if int_count:
+        ints, i = _array_from_bytes('q', data, i, int_count)
+        objects.extend(ints)
+    if float_count:
+        floats, i = _array_from_bytes('d', data, i, float_count)
+        objects.extend(floats)
+    if i != len(data):
+        raise CodecError('Trailing data after nc CST blob')
+
+    try:
+        objects.extend([int(strings[k]) for k in bigints])
+        objects.extend([
+            base.Source(path=strings[sources[k]], data=strings[sources[k + 1]])
+            for k in range(0, len(sources), 2)
+        ])
+
+        builders = _BUILDERS
+        k = 0
+        while k < code_count:
+            k = builders[codes[k]](objects, codes, k + 1)
+        if k != code_count:
+            raise CodecError('Corrupt nc CST blob')
+        return objects[root]
+    except (IndexError, ValueError) as e:
+        raise CodecError('Corrupt nc CST blob') from e
+
+
+def dumps(node):
+    encoder = _Encoder()
+    return encoder.finish(encoder.value(node))
+
+
+def loads(data):
+    return _decode(bytes(data))
+
+
+def main():
+    """Compare throughput against pickle on the given nc files
+    """
+    from . import parser
+    import argparse
+    import os
+    import pickle
+    import time
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('paths', nargs='*')
+    argparser.add_argument('--repeat', type=int, default=20)
+    args = argparser.parse_args()
+    paths = args.paths or [
+        os.path.join(os.path.dirname(__file__), 'root', '_prelude.nc'),
+        os.path.join(os.path.dirname(__file__), 'hello.nc'),
+    ]
+    for path in paths:
+        with open(path) as f:
+            node = parser.parse(f.read(), path=path)
+        for name, dump, load in [
+                ('codec', dumps, loads),
+                ('pickle', pickle.dumps, pickle.loads)]:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                blob = dump(node)
+            dump_time = (time.perf_counter() - start) / args.repeat
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                load(blob)
+            load_time = (time.perf_counter() - start) / args.repeat
+            print(
+                f'{os.path.basename(path).ljust(16)} {name.ljust(8)} '
+                f'size={len(blob):8d}B '
+                f'dump={dump_time * 1000:8.3f}ms '
+                f'load={load_time * 1000:8.3f}ms'
+            )
+
+
+if __name__ == '__main__':
+    main()
+
+
+def _marks(node):
+    if isinstance(node, tuple):
+        for item in node:
+            yield from _marks(item)
+    elif isinstance(node, cst.Node):
+        yield node.mark
+        for field_name in _FIELD_NAMES[_NODE_TAGS[type(node)]]:
+            yield from _marks(getattr(node, field_name))
+
+
+@test.case
+def test_round_trip():
+    from . import parser
+    node = parser.parse(r"""
+    from io import open as fopen
+    native class List[T] {
+        int size()
+    }
+    # some comment
+    class Foo[T < Base] < Base {
+        List[T] items
+        double ratio
+        int size() = 12
+    }
+    string greet() = {
+        final x = 'hello'
+        final f = fopen("setup.py", "r")
+        print(f.read())
+        x
+    }
+    """, path='<test>')
+    blob = dumps(node)
+    decoded = loads(blob)
+    test.equal(decoded, node)
+    test.equal(list(_marks(decoded)), list(_marks(node)))
+
+    # Every mark should share a single decoded Source
+    test.equal(len({id(mark.source) for mark in _marks(decoded)}), 1)
+
+    values = (
+        1.5, -0.0, 0.0, -7, 0, 1 << 70, None, True, False, 'x', (), ((1,), 2),
+    )
+    decoded = loads(dumps(values))
+    test.equal(decoded, values)
+    test.equal([repr(value) for value in decoded], [
+        repr(value) for value in values
+    ])
+
+    unmarked = cst.Block(mark=None, expressions=(
+        cst.Name(mark=None, value='x'),
+        cst.Int(mark=node.mark, value=1 << 40),
+    ))
+    decoded = loads(dumps(unmarked))
+    test.equal(decoded, unmarked)
+    test.equal(list(_marks(decoded)), list(_marks(unmarked)))
+
+    @test.throws(CodecError)
+    def invalid_blob():
+        loads(b'NOPE')
+
+    @test.throws(CodecError)
+    def unsupported_value():
+        dumps([1, 2])
+
+
+@memoize
+def _prelude_blob():
+    from . import parser
+    import os
+    path = os.path.join(os.path.dirname(__file__), 'root', '_prelude.nc')
+    with open(path) as f:
+        return dumps(parser.parse(f.read(), path=path))
+
+
+@test.bench
+def bench_loads():
+    blob = _prelude_blob()
+    for _ in range(100):
+        loads(blob)
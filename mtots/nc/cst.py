@@ -19,6 +19,18 @@ class ValueExpression(Node):
     pass
 
 
+@typing.enforce
+@dataclass(frozen=True)
+class Error(
+        base.ErrorNode,
+        FileLevelStatement,
+        TypeExpression,
+        ValueExpression):
+    """Placeholder for code that failed to parse
+    (only created by parser.parse_with_recovery)
+    """
+
+
 @typing.enforce
 @dataclass(frozen=True)
 class LineComment(Node):
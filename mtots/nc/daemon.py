@@ -0,0 +1,206 @@
+"""Compiler daemon for nc
+
+Running 'python -m mtots.nc --serve' starts a server that listens on a
+Unix domain socket, and keeps the compiler (grammar, parsed prelude,
+caches) warm between compiles.
+Running 'python -m mtots.nc --client file.nc' forwards the compile
+request to that server instead of compiling in-process.
+
+The protocol is one JSON object per line in each direction:
+
+    request:  {"path": <str>, "data": <str>}
+    response: {"output": <str>} or {"error": <str>}
+
+Only the server imports the compiler itself, so the client only pays
+for interpreter startup and a round trip over the socket.
+"""
+from mtots import test
+import json
+import os
+import socket
+import socketserver
+import stat
+import tempfile
+import threading
+import traceback
+
+
+DEFAULT_SOCKET_PATH = os.path.join(
+    tempfile.gettempdir(),
+    f'mtots-nc-{os.getuid() if hasattr(os, "getuid") else "user"}.sock',
+)
+
+
+class DaemonError(Exception):
+    pass
+
+
+def compile_source(data, *, path='<string>'):
+    from . import cxx
+    from . import resolver
+    return cxx.render(resolver.load(data, path=path))
+
+
+def compile_path(path):
+    from . import cxx
+    from . import resolver
+    return cxx.render(resolver.load_path(path))
+
+
+def _handle_request(request):
+    from mtots.parser import base
+    try:
+        return {'output': compile_source(
+            request['data'],
+            path=request['path'],
+        )}
+    except base.Error as e:
+        return {'error': str(e)}
+    except Exception:
+        return {'error': traceback.format_exc()}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            response = _handle_request(json.loads(line.decode('utf-8')))
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+def _check_unix_sockets_supported():
+    if not hasattr(socket, 'AF_UNIX'):
+        raise DaemonError('Unix domain sockets are not supported here')
+
+
+def _remove_stale_socket(socket_path):
+    """Removes the socket at socket_path if no daemon is listening on it.
+    Raises DaemonError if something other than a socket is there,
+    or if a daemon is still serving on it.
+    """
+    try:
+        mode = os.stat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise DaemonError(f'{socket_path} exists and is not a socket')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except ConnectionRefusedError:
+            pass
+        except FileNotFoundError:
+            return
+        else:
+            raise DaemonError(
+                f'An nc daemon is already serving at {socket_path}')
+    os.unlink(socket_path)
+
+
+def make_server(socket_path=DEFAULT_SOCKET_PATH):
+    """Create a server bound to socket_path with all caches warmed up.
+    A stale socket left at socket_path by a daemon that is no longer
+    running is removed first.
+    """
+    _check_unix_sockets_supported()
+    _remove_stale_socket(socket_path)
+
+    # Compiling an empty program builds the grammar,
+    # and parses and caches the prelude.
+    compile_source('')
+
+    return socketserver.UnixStreamServer(socket_path, _RequestHandler)
+
+
+def serve(socket_path=DEFAULT_SOCKET_PATH):
+    server = make_server(socket_path)
+    inode = os.stat(socket_path).st_ino
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        # Only remove the socket if it is still ours
+        try:
+            if os.stat(socket_path).st_ino == inode:
+                os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def request_compile(data, *, path, socket_path=DEFAULT_SOCKET_PATH):
+    """Ask the daemon at socket_path to compile data.
+    Returns the rendered output, or raises DaemonError if compilation
+    failed or the daemon could not be reached.
+    """
+    _check_unix_sockets_supported()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError as e:
+            raise DaemonError(
+                f'Could not connect to nc daemon at {socket_path} ({e}) '
+                f'(start one with "python -m mtots.nc --serve")') from e
+        with sock.makefile('rwb') as f:
+            request = {'path': path, 'data': data}
+            f.write(json.dumps(request).encode('utf-8') + b'\n')
+            f.flush()
+            line = f.readline()
+    if not line:
+        raise DaemonError('nc daemon closed the connection')
+    response = json.loads(line.decode('utf-8'))
+    if 'error' in response:
+        raise DaemonError(response['error'])
+    return response['output']
+
+
+@test.case
+def test_daemon_round_trip():
+    if not hasattr(socket, 'AF_UNIX'):
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        socket_path = os.path.join(tmpdir, 'nc.sock')
+        server = make_server(socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            data = r"""
+            int main() = {
+                print("Hello world!")
+                0
+            }
+            """
+            test.equal(
+                request_compile(data, path='<test>', socket_path=socket_path),
+                compile_source(data, path='<test>'),
+            )
+
+            @test.throws(DaemonError)
+            def compile_error():
+                request_compile(
+                    'class Foo {}\nclass Foo {}\n',
+                    path='<test>',
+                    socket_path=socket_path,
+                )
+
+            @test.throws(DaemonError)
+            def already_serving():
+                make_server(socket_path)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        # The socket file is left behind, but nothing listens on it now
+        make_server(socket_path).server_close()
+
+        regular_path = os.path.join(tmpdir, 'not-a-socket')
+        with open(regular_path, 'w') as f:
+            f.write('keep me')
+
+        @test.throws(DaemonError)
+        def not_a_socket():
+            make_server(regular_path)
+
+        with open(regular_path) as f:
+            test.equal(f.read(), 'keep me')
@@ -193,59 +193,93 @@ def lexer(builder):
         else:
             return [base.Token(mark, 'ID', name)]
 
-    def should_skip_newline(stack):
-        return stack and stack[-1].type != '{'
-
-    @builder.add_adapter
-    def remove_nested_newlines_adapter(tokens):
-        grouping_map = {
-            '(': ')',
-            '{': '}',
-            '[': ']',
-        }
-        openers = tuple(grouping_map.keys())
-        closers = tuple(grouping_map.values())
+    grouping_map = {
+        '(': ')',
+        '{': '}',
+        '[': ']',
+    }
+    closers = frozenset(grouping_map.values())
+
+    @builder.add_filter
+    def remove_nested_newlines_filter(emit, report):
+        # Entries are [opening token, first NEWLINE dropped inside it]
         stack = []
-        for token in tokens:
-            if token.type in openers:
-                stack.append(token)
-            elif token.type in closers:
+
+        def push(token):
+            type_ = token.type
+            if type_ in grouping_map:
+                stack.append([token, None])
+            elif type_ in closers:
                 if not stack:
-                    raise errors.InvalidGrouping(
-                        [token.mark], f'Unmatched closing symbol')
-                opener = stack.pop()
-                if grouping_map[opener.type] != token.type:
-                    raise errors.InvalidGrouping(
+                    report(errors.InvalidGrouping(
+                        [token.mark], f'Unmatched closing symbol'))
+                    return
+                opener = stack[-1][0]
+                if grouping_map[opener.type] != type_:
+                    report(errors.InvalidGrouping(
                         [opener.mark, token.mark],
-                        f'Mismatched grouping symbols')
-            elif token.type == 'NEWLINE' and should_skip_newline(stack):
-                continue
-            yield token
-
-    @builder.add_adapter
-    def remove_consecutive_newlines_adapter(tokens):
-        try:
-            while True:
-                last_token = next(tokens)
-                if last_token.type == 'NEWLINE':
-                    token = next(tokens)
-                    while token.type == 'NEWLINE':
-                        last_token = token
-                        token = next(tokens)
-                    yield last_token
-                    yield token
-                else:
-                    yield last_token
-        except StopIteration:
-            pass
+                        f'Mismatched grouping symbols'))
+                    if not any(
+                            grouping_map[t.type] == type_ for t, _ in stack):
+                        # Drop the stray closing symbol
+                        return
+                    close_unclosed_groupings(token)
+                stack.pop()
+            elif type_ == 'NEWLINE' and stack and stack[-1][0].type != '{':
+                if stack[-1][1] is None:
+                    stack[-1][1] = token
+                return
+            emit(token)
+
+        def close_unclosed_groupings(closing_token):
+            # An enclosing grouping is closed here, so assume that the
+            # ones inside it are just missing their closing symbols.
+            # If a NEWLINE was dropped inside them, that is where they
+            # most likely should have been closed, so that NEWLINE is
+            # put back.
+            newline = None
+            while grouping_map[stack[-1][0].type] != closing_token.type:
+                opener, dropped_newline = stack.pop()
+                newline = dropped_newline or newline
+                mark = (newline or closing_token).mark
+                emit(base.Token(
+                    base.Mark(mark.source, mark.start, mark.start),
+                    grouping_map[opener.type],
+                    None,
+                ))
+            if newline is not None:
+                if stack[-1][0].type == '{':
+                    emit(newline)
+                elif stack[-1][1] is None:
+                    stack[-1][1] = newline
+
+        return push
+
+    @builder.add_filter
+    def remove_consecutive_newlines_filter(emit, report):
+        # Of every run of consecutive NEWLINE tokens,
+        # only the last one is kept.
+        pending_newline = None
+
+        def push(token):
+            nonlocal pending_newline
+            if token.type == 'NEWLINE':
+                pending_newline = token
+                return
+            if pending_newline is not None:
+                emit(pending_newline)
+                pending_newline = None
+            emit(token)
+
+        return push
 
 
 def lex_string(s: str):
     return lexer.lex_string(s)
 
 
-def lex(source: base.Source):
-    return lexer.lex(source)
+def lex(source: base.Source, *, errors=None):
+    return lexer.lex(source, errors=errors)
 
 
 if __name__ == '__main__':
@@ -308,6 +342,29 @@ def test_newline_and_grouping():
     list(lex_string('[ ]'))
 
 
+@test.case
+def test_grouping_recovery():
+    def lex_with_errors(s):
+        errors = []
+        tokens = list(lex(base.Source.from_string(s), errors=errors))
+        return (
+            [token.type for token in tokens],
+            [str(e).splitlines()[0] for e in errors],
+        )
+
+    # Groupings left open inside a closed one get their closing symbols
+    test.equal(lex_with_errors('{ ( [ }'), (
+        ['{', '(', '[', ']', ')', '}', 'EOF'],
+        ['Mismatched grouping symbols'],
+    ))
+
+    # Closing symbols that close nothing are dropped
+    test.equal(lex_with_errors('( ] ) ]'), (
+        ['(', ')', 'EOF'],
+        ['Mismatched grouping symbols', 'Unmatched closing symbol'],
+    ))
+
+
 @test.case
 def test_triple_quote():
     test.equal(
@@ -11,6 +11,10 @@ from mtots.parser.combinator import Forward
 from mtots.parser.combinator import Peek
 from mtots.parser.combinator import Required
 from mtots.parser.combinator import Token
+from mtots.util.memoizer import memoize
+import os
+import subprocess
+import sys
 
 
 def Struct(*args, **kwargs):
@@ -46,6 +50,7 @@ file_ = Forward(lambda: Struct(cst.File, [
         All(class_),
         All(function),
         All('NEWLINE').valmap(()),
+        All(combinator.SkipUnexpected()),
     ).repeat().flatten().map(tuple)],
 ]))
 
@@ -238,6 +243,37 @@ def parse(data, *, path='<string>'):
     )
 
 
+def parse_path(path, *, use_mmap=True):
+    """Parse the nc file at path, see base.Source.from_path
+    """
+    return combinator.parse_source(
+        pattern=file_,
+        source=base.Source.from_path(path, use_mmap=use_mmap),
+        lexer=lexer,
+    )
+
+
+_recovery = combinator.Recovery(
+    sync_types=('NEWLINE', '}', ')'),
+    error_node_type=cst.Error,
+)
+
+
+def parse_with_recovery(data, *, path='<string>'):
+    """Like parse, but keeps going after syntax errors.
+
+    Returns a (cst.File, errors) pair, where parts of the file that
+    failed to parse are replaced with cst.Error nodes.
+    """
+    return combinator.parse_pattern(
+        pattern=file_,
+        data=data,
+        path=path,
+        lexer=lexer,
+        recovery=_recovery,
+    )
+
+
 @test.case
 def test_sanity():
     # For now, just check this doesn't throw
@@ -252,3 +288,142 @@ def test_sanity():
     string foo() = 'hello world'
     int main() = 0
     """)
+
+
+@test.case
+def test_parse_with_recovery():
+    file_node, errors = parse_with_recovery(r"""
+    from abc import
+    class Foo {
+        string x
+    }
+    inline foo "x"
+    int bar() = 0
+    string baz() =
+    """)
+    test.equal(
+        [str(e).splitlines()[0] for e in errors],
+        [
+            'Expected ID but got NEWLINE',
+            'Expected STR but got NEWLINE',
+            'Expected new but got NEWLINE',
+        ],
+    )
+    test.equal(
+        [type(stmt).__name__ for stmt in file_node.statements],
+        ['Error', 'Class', 'Error', 'Function', 'Function'],
+    )
+    test.that(isinstance(file_node.statements[-1].body, cst.Error))
+
+    def error_summary(data):
+        file_node, errors = parse_with_recovery(data)
+        return (
+            [type(stmt).__name__ for stmt in file_node.statements],
+            [str(e).splitlines()[0] for e in errors],
+        )
+
+    # A stray closing symbol left behind by a recovery is skipped,
+    # without reporting it as another error.
+    test.equal(error_summary('int main() = foo(1, 2\nint bar() = 0\n'), (
+        ['Function', 'Error'],
+        ['Expected ) but got int'],
+    ))
+    test.equal(error_summary('List[int main() = 0\n'), (
+        ['Error', 'Error'],
+        ['Expected ] but got ID'],
+    ))
+    test.equal(error_summary('int f() = 0\n?\nint g() = 1\n'), (
+        ['Function', 'Error', 'Function'],
+        ['Unexpected ?'],
+    ))
+
+    # Grouping errors from the lexer are collected too
+    test.equal(error_summary(
+        'class Foo {\n  int x(\n}\nint bar() = 0\n)\nint baz() = 0\n'), (
+        ['Class', 'Function', 'Function'],
+        ['Mismatched grouping symbols', 'Unmatched closing symbol'],
+    ))
+
+    # Without errors, this should be the same as parse
+    source = 'int main() = 0\n'
+    test.equal(parse_with_recovery(source), (parse(source), []))
+
+
+@test.case
+def test_parse_many_in_processes():
+    import concurrent.futures
+
+    sources = ['int main() = 0\n', 'int f() = \n', 'string s() = "x"\n']
+    with concurrent.futures.ProcessPoolExecutor(2) as executor:
+        results = combinator.parse_many(
+            'mtots.nc.parser:file_',
+            sources,
+            'mtots.nc.lexer',
+            executor=executor,
+            chunk_size=1,
+        )
+    test.equal(results[0], parse(sources[0]))
+    test.that(isinstance(results[1], base.Error))
+    test.equal(results[2], parse(sources[2]))
+
+
+def _run_with_bytecode_cache(code, *extra_args):
+    """Runs code in a fresh interpreter from the repository root,
+    with bytecode compiled into (and reused from) a private cache,
+    so that imports behave the way an installed package would see them
+    (even if PYTHONDONTWRITEBYTECODE is set here).
+    """
+    process = subprocess.run(
+        [sys.executable, *extra_args, '-c', code],
+        cwd=os.path.join(os.path.dirname(__file__), '..', '..'),
+        env=_bytecode_cache_env(),
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    test.that(process.returncode == 0, process.stderr)
+    return process.stderr
+
+
+@memoize
+def _bytecode_cache_env():
+    import atexit
+    import shutil
+    import tempfile
+    pycache_prefix = tempfile.mkdtemp(prefix='mtots-pycache-')
+    atexit.register(shutil.rmtree, pycache_prefix, True)
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=pycache_prefix)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return env
+
+
+@test.slow
+def test_import_footprint():
+    # Importing and using the parser should not pull in modules that
+    # are only needed for the command line
+    stderr = _run_with_bytecode_cache(
+        'import mtots.nc.parser\n'
+        'mtots.nc.parser.parse("int main() = 0\\n")\n',
+        '-X', 'importtime',
+    )
+    imported = {
+        line.rpartition('|')[2].strip()
+        for line in stderr.splitlines()
+        if line.startswith('import time:') and '|' in line
+    }
+    test.that('mtots.nc.parser' in imported, stderr)
+    test.that('argparse' not in imported, 'argparse was imported')
+
+
+@test.bench(warmup=2, repeat=10)
+def bench_import():
+    # Includes starting the interpreter, which is roughly constant,
+    # so changes in the median come from importing mtots.nc.parser
+    _run_with_bytecode_cache('import mtots.nc.parser')
+
+
+@test.bench
+def bench_parse_prelude():
+    path = os.path.join(os.path.dirname(__file__), 'root', '_prelude.nc')
+    with open(path) as f:
+        data = f.read()
+    parse(data, path=path)
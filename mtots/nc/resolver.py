@@ -4,8 +4,6 @@ from . import errors
 from . import lexer
 from . import parser
 from .scopes import Scope
-from .ast import apply_reified_bindings
-from .ast import get_reified_bindings
 from mtots import test
 from mtots import util
 import os
@@ -22,6 +20,10 @@ def load(data, *, path='<string>'):
     return resolve(parser.parse(data=data, path=path))
 
 
+def load_path(path):
+    return resolve(parser.parse_path(path))
+
+
 def _import_path_to_file_path(import_path):
     return os.path.join(
         _source_root,
@@ -29,11 +31,31 @@ def _import_path_to_file_path(import_path):
     )
 
 
+# file_path -> ((st_mtime_ns, st_size), cst.File)
+# CST nodes are immutable, so parsed library files (e.g. the prelude)
+# can be safely shared between loads until the file changes.
+# The size is part of the key since edits within the mtime granularity
+# of the file system do not change the mtime.
+_parse_cache = {}
+
+
 def _find_and_parse(import_path: str):
-    file_path = _import_path_to_file_path(import_path)
-    with open(file_path) as f:
-        data = f.read()
-    return parser.parse(data, path=file_path)
+    return _parse_cached(_import_path_to_file_path(import_path))
+
+
+def _parse_cached(file_path):
+    st = os.stat(file_path)
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _parse_cache.get(file_path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    # Cached nodes can outlive the file they were parsed from
+    # (e.g. in the compiler daemon), and reading an mmap of a file
+    # that was truncated in the meantime crashes the process,
+    # so library files are read into memory instead.
+    node = parser.parse_path(file_path, use_mmap=False)
+    _parse_cache[file_path] = (key, node)
+    return node
 
 
 def _collect_file_nodes(node: cst.File, seen: set):
@@ -54,7 +76,8 @@ def resolve(node: cst.File):
     name_file_node_pairs.extend(_collect_file_nodes(node, seen))
     name_file_node_pairs.append(('_main', node))
     global_scope = Scope(None)
-    global_scope['@after_resolve_types_callbacks'] = []
+    global_scope['@validated_reified_types'] = set()
+    global_scope['@unvalidated_reified_types'] = {}
     file_scope_map = {
         import_name: Scope(global_scope)
         for import_name, _ in name_file_node_pairs
@@ -82,10 +105,11 @@ def resolve(node: cst.File):
         global_scope[short_name] = prelude_entry_node
 
     _run_resolve_pass(_resolve_types)
-    for callback in global_scope['@after_resolve_types_callbacks']:
-        callback()
-    global_scope.table.pop('@after_resolve_types_callbacks')
+    unvalidated = global_scope.table.pop('@unvalidated_reified_types')
+    for reified_type, cst_node in unvalidated.items():
+        _validate_reified_type(reified_type, cst_node, global_scope)
     _run_resolve_pass(_resolve_expressions)
+    global_scope.table.pop('@validated_reified_types')
 
     assert global_scope.parent is None
     return {node.name: node for node in global_scope.table.values()}
@@ -542,10 +566,12 @@ def _eval_expression(on):
                     _eval_type(t, scope) for t in node.type_arguments
                 )
 
-            generic_bindings = get_reified_bindings(
-                type_parameters=fn.type_parameters,
+            signature = ast.instantiate_function(
+                function=fn,
                 type_arguments=type_arguments,
             )
+            param_types = signature.parameter_types
+            return_type = signature.return_type
         else:
             if node.type_arguments is None:
                 type_arguments = None
@@ -553,16 +579,12 @@ def _eval_expression(on):
                 with scope.push_mark(node.mark, fn.mark):
                     raise scope.error(
                         f'{node.name} is not a generic function')
+            param_types = tuple(param.type for param in fn.parameters)
+            return_type = fn.return_type
 
         args = []
-        for param, raw_arg in zip(fn.parameters, raw_args):
-            if fn.generic:
-                param_type = apply_reified_bindings(
-                    type=param.type,
-                    bindings=generic_bindings,
-                )
-            else:
-                param_type = param.type
+        for param, param_type, raw_arg in zip(
+                fn.parameters, param_types, raw_args):
             arg = _convert_type(param_type, raw_arg)
             if arg is None:
                 with scope.push_mark(raw_arg.mark, param.mark):
@@ -571,14 +593,6 @@ def _eval_expression(on):
                         f'to be type {param_type} but got {raw_arg.type}')
             args.append(arg)
 
-        if fn.generic:
-            return_type = apply_reified_bindings(
-                type=fn.return_type,
-                bindings=generic_bindings,
-            )
-        else:
-            return_type = fn.return_type
-
         return ast.FunctionCall(
             mark=node.mark,
             type=return_type,
@@ -632,14 +646,19 @@ def _eval_expression(on):
                     param_type.class_ == arg_type.class_ and
                     len(param_type.type_arguments) ==
                         len(arg_type.type_arguments)):
-                type_arguments = [
-                    _unify_types(p, a, bindings, scope)
+                type_arguments = tuple(
+                    _unify_types(
+                        param_type=p,
+                        arg_type=a,
+                        bindings=bindings,
+                        scope=scope,
+                    )
                     for p, a in zip(
                         param_type.type_arguments,
                         arg_type.type_arguments,
                     )
-                ]
-                return ast.ReifiedType(
+                )
+                return ast.ReifiedType.intern(
                     mark=param_type.mark,
                     class_=param_type.class_,
                     type_arguments=type_arguments,
@@ -751,39 +770,46 @@ def _eval_type(on):
             for e in node.type_arguments
         )
 
-        reified_type = ast.ReifiedType(
+        reified_type = ast.ReifiedType.intern(
             mark=node.mark,
             class_=class_,
             type_arguments=type_arguments,
         )
 
-        def _validate_reified_type():
-            # We play this callback dance because we need to sometimes
-            # call _eval_type before all types have fully materialized.
-            # E.g. class_.type_parameters might not be ready yet.
-            # So for cases in which they aren't, we save the validation
-            # code in a callback to be called at a later point
-            # after all types have been fully resolved.
-            for tparam, targ, cst_targ in zip(
-                    class_.type_parameters,
-                    type_arguments,
-                    node.type_arguments):
-                if (tparam.base is not None and
-                        not targ.usable_as(tparam.base)):
-                    with scope.push_mark(cst_targ.mark, tparam.mark):
-                        raise scope.error(
-                            f'{targ} is not usable as {tparam.base}')
-
-        if '@after_resolve_types_callbacks' in scope.root.table:
-            scope.root['@after_resolve_types_callbacks'].append(
-                _validate_reified_type,
-            )
-        else:
-            _validate_reified_type()
+        # We sometimes need to call _eval_type before all types have
+        # fully materialized (e.g. class_.type_parameters might not
+        # be ready yet). So until types are resolved, we just remember
+        # the first occurrence of every distinct type, and validate
+        # each of them once all types have been fully resolved.
+        root_table = scope.root.table
+        if reified_type not in root_table['@validated_reified_types']:
+            if '@unvalidated_reified_types' in root_table:
+                root_table['@unvalidated_reified_types'].setdefault(
+                    reified_type,
+                    node,
+                )
+            else:
+                _validate_reified_type(reified_type, node, scope)
 
         return reified_type
 
 
+def _validate_reified_type(reified_type, cst_node, scope):
+    """Check that the type arguments of reified_type satisfy the bounds
+    of the type parameters of its class.
+    cst_node is the cst.ReifiedType that the type came from, and is
+    only used for error reporting.
+    """
+    for tparam, targ, cst_targ in zip(
+            reified_type.class_.type_parameters,
+            reified_type.type_arguments,
+            cst_node.type_arguments):
+        if tparam.base is not None and not targ.usable_as(tparam.base):
+            with scope.push_mark(cst_targ.mark, tparam.mark):
+                raise scope.error(f'{targ} is not usable as {tparam.base}')
+    scope.root['@validated_reified_types'].add(reified_type)
+
+
 @test.case
 def test_sanity():
     # Just check that this loads without throwing
@@ -804,3 +830,109 @@ def test_sanity():
         class Foo {}
         class Foo {}
         """)
+
+
+@test.case
+def test_generic_instantiation_cache():
+    result = load(r"""
+    List[T] pair[T](T a, T b) = new(List[T])
+    int main() = {
+        pair(1, 2)
+        pair(3, 4)
+        pair[string]('a', 'b')
+        0
+    }
+    """)
+    pair = result['_main.pair']
+    main_body = result['_main.main'].body
+    first, second, third = main_body.expressions[:3]
+    test.that(first.type is second.type)
+    test.that(first.type is not third.type)
+    test.equal(len(pair.instantiations), 2)
+
+
+@test.case
+def test_reified_types_are_interned():
+    result = load(r"""
+    List[int] make() = new(List[int])
+    int size(List[int] xs) = 0
+    int main() = size(make())
+    """)
+    make = result['_main.make']
+    size = result['_main.size']
+    test.that(make.return_type is size.parameters[0].type)
+    test.that(make.return_type is make.body.type)
+    test.that(make.return_type == size.parameters[0].type)
+
+
+@test.case
+def test_reified_type_bounds():
+    load(r"""
+    trait Base {}
+    class Impl < Base {}
+    class Box[T < Base] {
+        Box[Impl] a
+        Box[Impl] b
+    }
+    Box[Impl] make() = new(Box[Impl])
+    """)
+
+    @test.throws(errors.TypeError)
+    def unusable_type_argument():
+        load(r"""
+        trait Base {}
+        class Box[T < Base] {}
+        class Foo {
+            Box[int] a
+            Box[int] b
+        }
+        """)
+
+    @test.throws(errors.TypeError)
+    def unusable_type_argument_in_expression():
+        load(r"""
+        trait Base {}
+        class Box[T < Base] {}
+        int main() = {
+            final box = new(Box[string])
+            0
+        }
+        """)
+
+
+@test.bench
+def bench_resolve():
+    load(r"""
+    trait Base {}
+    class Impl < Base {}
+    class Box[T < Base] {
+        T value
+    }
+    List[T] pair[T](T a, T b) = new(List[T])
+    int main() = {
+        final box = new(Box[Impl])
+        pair(1, 2)
+        pair('a', 'b')
+        0
+    }
+    """)
+
+
+@test.case
+def test_parse_cache():
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'lib.nc')
+        with open(path, 'w') as f:
+            f.write('int f() = 0\n')
+        node = _parse_cached(path)
+        test.that(_parse_cached(path) is node)
+
+        # An edit that keeps the mtime (e.g. within the file system's
+        # mtime granularity) still invalidates the cached parse
+        mtime_ns = os.stat(path).st_mtime_ns
+        with open(path, 'w') as f:
+            f.write('int f() = 0\nint g() = 1\n')
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+        test.equal(len(_parse_cached(path).statements), 2)
+        del _parse_cache[path]
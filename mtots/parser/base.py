@@ -3,23 +3,80 @@ from mtots.util import dataclasses
 from mtots.util.dataclasses import dataclass
 from mtots.util.typing import Iterator
 from mtots.util.typing import Tuple
-import argparse
-import json
+import mmap
+import os
 import re
 import sys
 from mtots.util import typing
 
 
+# Bytes that keep data from being lexed as bytes:
+# non-ASCII bytes would make byte offsets differ from str offsets,
+# and \x1c-\x1f match '\s' in str patterns but not in bytes patterns
+_NOT_BYTES_LEXABLE = re.compile(rb'[^\x00-\x1b\x20-\x7f]')
+
+
 @dataclass(frozen=True)
 class Source:
     path: str
-    data: str
+
+    # Either a str, or an ASCII-only bytes-like object (bytes or mmap).
+    # For ASCII data, byte offsets and str offsets are the same, so
+    # marks into either kind of data mean the same thing.
+    data: object
+
     metadata: object = None
 
     @staticmethod
     def from_string(data):
         return Source('<string>', data)
 
+    @staticmethod
+    def from_bytes(data, path='<bytes>'):
+        """Source for UTF-8 encoded data.
+
+        If the data can be lexed as bytes with the same results as
+        its decoded str (i.e. it is ASCII), it is kept as is,
+        otherwise it is decoded.
+        """
+        if _NOT_BYTES_LEXABLE.search(data):
+            return Source(path, str(data, 'utf-8'))
+        return Source(path, data)
+
+    @staticmethod
+    def from_path(path, *, use_mmap=True):
+        """Load the UTF-8 encoded file at path.
+
+        If the file is pure ASCII without carriage returns (the common
+        case for source code), the data is the mmap of the file, so that
+        lexing does not need a decoded copy of it in memory. Otherwise
+        the file is decoded with universal newlines, like
+        open(path).read() would.
+        """
+        with open(path, 'rb') as f:
+            if use_mmap and os.fstat(f.fileno()).st_size:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = f.read()
+        if _NOT_BYTES_LEXABLE.search(data) or data.find(b'\r') != -1:
+            text = str(data, 'utf-8')
+            if isinstance(data, mmap.mmap):
+                data.close()
+            data = text.replace('\r\n', '\n').replace('\r', '\n')
+        return Source(path, data)
+
+    @property
+    def text(self) -> str:
+        """The data as a str (decoded and cached if necessary)
+        """
+        if isinstance(self.data, str):
+            return self.data
+        text = vars(self).get('_text')
+        if text is None:
+            text = str(self.data, 'ascii')
+            object.__setattr__(self, '_text', text)
+        return text
+
 
 @dataclass(frozen=True)
 class Mark:
@@ -36,24 +93,33 @@ class Mark:
     def lineno(self) -> int:
         assert self.source is not None
         assert self.i is not None
-        return self.source.data.count('\n', 0, self.i) + 1
+        s = self.source.data
+        if isinstance(s, str):
+            return s.count('\n', 0, self.i) + 1
+        else:
+            # mmap has no count method
+            return s[:self.i].count(b'\n') + 1
 
     @property
     def colno(self) -> int:
         assert self.source is not None
         assert self.i is not None
-        return self.i - self.source.data.rfind('\n', 0, self.i)
+        s = self.source.data
+        newline = '\n' if isinstance(s, str) else b'\n'
+        return self.i - s.rfind(newline, 0, self.i)
 
     @property
     def line(self) -> str:
         assert self.source is not None
         assert self.i is not None
         s = self.source.data
-        a = s.rfind('\n', 0, self.i) + 1
-        b = s.find('\n', self.i)
+        newline = '\n' if isinstance(s, str) else b'\n'
+        a = s.rfind(newline, 0, self.i) + 1
+        b = s.find(newline, self.i)
         if b == -1:
             b = len(s)
-        return s[a:b]
+        line = s[a:b]
+        return line if isinstance(line, str) else str(line, 'ascii')
 
     @property
     def info(self) -> str:
@@ -107,6 +173,18 @@ class Error(Exception):
             message + '\n' + ''.join(mark.info for mark in marks)
         )
 
+    def __reduce__(self):
+        # The marks are already rendered into the message, so that is
+        # all that is needed to rebuild the error (e.g. when it is sent
+        # back from a worker process).
+        return _restore_error, (type(self), self.args)
+
+
+def _restore_error(cls, args):
+    error = cls.__new__(cls)
+    error.args = args
+    return error
+
 
 class ParseError(Error):
     pass
@@ -131,6 +209,14 @@ class Node:
         return args
 
 
+@dataclass(frozen=True)
+class ErrorNode(Node):
+    """Stands in for a part of the input that failed to parse
+    when parsing in error-recovery mode (see combinator.Recovery)
+    """
+    message: str
+
+
 @dataclass(frozen=True)
 class Pattern:
     regex: typing.Pattern
@@ -147,13 +233,51 @@ class Pattern:
         return wrapper
 
 
-@dataclass
-class TextStream:
-    source: Source
-    i: int
+class _DecodedMatch(tuple):
+    """Wraps a match against ASCII bytes, so that lexer callbacks
+    get the same str values that they would get when lexing a str.
+    Only the groups that a callback asks for are decoded.
+
+    This is created for every token in bytes mode, so it is a
+    1-tuple of the match (which is built without running any Python
+    code) rather than a regular class.
+    """
+    __slots__ = ()
+
+    def group(self, *args):
+        if not args:
+            return _tuple_getitem(self, 0).group().decode('ascii')
+        value = _tuple_getitem(self, 0).group(*args)
+        if len(args) > 1:
+            return tuple(_decode_group(v) for v in value)
+        return _decode_group(value)
+
+    def __getitem__(self, key):
+        return _decode_group(_tuple_getitem(self, 0)[key])
+
+    def groups(self, default=None):
+        return tuple(
+            _decode_group(v)
+            for v in _tuple_getitem(self, 0).groups(default)
+        )
+
+    def groupdict(self, default=None):
+        return {
+            k: _decode_group(v)
+            for k, v in _tuple_getitem(self, 0).groupdict(default).items()
+        }
 
-    def eof(self):
-        return self.i >= len(self.source.data)
+    def __getattr__(self, name):
+        # start, end, span, lastgroup, etc. mean the same thing
+        # for ASCII bytes as for str
+        return getattr(_tuple_getitem(self, 0), name)
+
+
+_tuple_getitem = tuple.__getitem__
+
+
+def _decode_group(value):
+    return value if value is None else value.decode('ascii')
 
 
 class Lexer:
@@ -161,6 +285,7 @@ class Lexer:
     class Builder:
         def __init__(self):
             self.patterns = []
+            self.filters = []
             self.adapters = []
 
         def add_pattern(self, pattern):
@@ -176,11 +301,36 @@ class Lexer:
                 return callback
             return wrapper
 
+        def add_filter(self, filter_):
+            """Add a stateful per-token filter.
+
+            Every time a source is lexed, filter_ is called with an
+            'emit' callback that passes tokens on to the next stage,
+            and a 'report' callback for errors the filter can recover
+            from, and should return a 'push' callback that the lexer
+            calls with every token (including the final EOF token).
+            State for a single lex can be kept in the closure.
+
+            report(error) raises the error, unless the lexer was asked
+            to collect errors (see Lexer.lex), in which case it returns
+            and the filter should carry on as best it can.
+
+            Unlike adapters, filters run inside the lexer's main loop,
+            so they don't each need their own generator frame.
+            Filters always run before any adapters.
+            """
+            self.filters.append(filter_)
+            return filter_
+
         def add_adapter(self, adapter):
             self.adapters.append(adapter)
 
         def build(self):
-            return Lexer(patterns=self.patterns, adapters=self.adapters)
+            return Lexer(
+                patterns=self.patterns,
+                adapters=self.adapters,
+                filters=self.filters,
+            )
 
     @staticmethod
     def new(f):
@@ -188,32 +338,83 @@ class Lexer:
         f(builder)
         return builder.build()
 
-    def __init__(self, patterns, adapters):
+    def __init__(self, patterns, adapters, filters=()):
         self._patterns = tuple(patterns)
         self._adapters = tuple(adapters)
+        self._filters = tuple(filters)
+        self._bytes_patterns = None
 
-    def _extract(self, stream):
-        i = stream.i
-        source = stream.source
-        data = source.data
-
-        for pattern in self._patterns:
-            m = pattern.regex.match(data, i)
-            if m:
-                mark = Mark(source, m.start(), m.end())
-                stream.i = m.end()
-                return pattern.callback(m, mark)
-
-        raise LexError([Mark(source, i, i)], 'Unrecognized token')
+    def _get_bytes_patterns(self):
+        """Returns the patterns compiled for matching against bytes,
+        or () if some pattern can only match str.
+        """
+        if self._bytes_patterns is None:
+            try:
+                self._bytes_patterns = tuple(
+                    Pattern(
+                        re.compile(
+                            pattern.regex.pattern.encode('ascii'),
+                            pattern.regex.flags & ~re.UNICODE,
+                        ),
+                        pattern.callback,
+                    )
+                    for pattern in self._patterns
+                )
+            except (UnicodeEncodeError, re.error):
+                self._bytes_patterns = ()
+        return self._bytes_patterns
+
+    def _lex_without_adapters(self, source, errors):
+        if errors is None:
+            def report(error):
+                raise error
+        else:
+            report = errors.append
 
-    def _lex_without_adapters(self, source):
-        stream = TextStream(source, 0)
-        while not stream.eof():
-            yield from self._extract(stream)
-        yield Token(Mark(source, stream.i, stream.i), 'EOF', None)
+        out = []
+        push = out.append
+        for filter_ in reversed(self._filters):
+            push = filter_(push, report)
 
-    def lex(self, source):
-        token_gen = self._lex_without_adapters(source)
+        data = source.data
+        patterns = self._patterns
+        decode = False
+        if not isinstance(data, str):
+            if self._get_bytes_patterns():
+                patterns = self._bytes_patterns
+                decode = True
+            else:
+                # Offsets are the same in the decoded text
+                data = source.text
+        n = len(data)
+        i = 0
+        while i < n:
+            for pattern in patterns:
+                m = pattern.regex.match(data, i)
+                if m:
+                    i = m.end()
+                    mark = Mark(source, m.start(), i)
+                    if decode:
+                        m = _DecodedMatch((m,))
+                    for token in pattern.callback(m, mark):
+                        push(token)
+                    break
+            else:
+                report(LexError([Mark(source, i, i)], 'Unrecognized token'))
+                i += 1
+            if out:
+                yield from out
+                out.clear()
+        push(Token(Mark(source, i, i), 'EOF', None))
+        yield from out
+
+    def lex(self, source, *, errors=None):
+        """Lex source into tokens.
+
+        If errors is a list, recoverable errors are appended to it
+        instead of being raised, and lexing continues after them.
+        """
+        token_gen = self._lex_without_adapters(source, errors)
         for adapter in self._adapters:
             token_gen = adapter(token_gen)
         return token_gen
@@ -221,34 +422,38 @@ class Lexer:
     def lex_string(self, s):
         return self.lex(Source.from_string(s))
 
+    def lex_bytes(self, b):
+        """Lex UTF-8 encoded bytes.
+        Token values are str, and marks have the same offsets
+        as when lexing the decoded str.
+        """
+        return self.lex(Source.from_bytes(b))
+
     def main(self):
         """Some functionality for if a lexer module
         is used as a main module.
         """
+        import argparse
+        import json
+
         parser = argparse.ArgumentParser()
         parser.add_argument('path', nargs='?')
         args = parser.parse_args()
 
-        opened_file = bool(args.path)
-        file = open(args.path) if args.path else sys.stdin
-        try:
-            path = args.path or '<stdin>'
-            contents = file.read()
-            source = Source(path, contents)
-            for token in self.lex(source):
-                print(json.dumps({
-                    'type': token.type,
-                    'value': token.value,
-                    'mark': {
-                        'start': token.mark.start,
-                        'end': token.mark.end,
-                        'main': token.mark.main,
-                    },
-                }))
-
-        finally:
-            if opened_file:
-                file.close()
+        if args.path:
+            source = Source.from_path(args.path)
+        else:
+            source = Source('<stdin>', sys.stdin.read())
+        for token in self.lex(source):
+            print(json.dumps({
+                'type': token.type,
+                'value': token.value,
+                'mark': {
+                    'start': token.mark.start,
+                    'end': token.mark.end,
+                    'main': token.mark.main,
+                },
+            }))
 
 
 class TokenStream:
@@ -260,6 +465,23 @@ class TokenStream:
         # for memoizing results.
         self._cache = {}
 
+        # combinator.Recovery if parsing in error-recovery mode,
+        # and the errors recovered from so far.
+        self.recovery = None
+        self.errors = []
+        self._error_keys = set()
+        self._last_recovery_state = None
+
+    def reset(self, tokens: Iterator[Token]):
+        """Reuse this stream (and its cache) for a new list of tokens
+        """
+        self.tokens[:] = tokens
+        self.i = 0
+        self._cache.clear()
+        self.errors = []
+        self._error_keys.clear()
+        self._last_recovery_state = None
+
     def __iter__(self):
         return self
 
@@ -377,3 +599,197 @@ def test_lexer_with_adapter():
         ]
     )
 
+
+
+@test.case
+def test_lexer_with_filter():
+
+    @Lexer.new
+    def lexer(builder):
+        @builder.add('\s+')
+        def spaces(m, mark):
+            return ()
+
+        @builder.add('\w+')
+        def name(m, mark):
+            return [Token(mark, 'NAME', m.group())]
+
+        @builder.add_filter
+        def drop_repeated_names(emit, report):
+            last_value = None
+
+            def push(token):
+                nonlocal last_value
+                if token.value != last_value:
+                    emit(token)
+                last_value = token.value
+
+            return push
+
+        @builder.add_filter
+        def double_every_name_token(emit, report):
+            def push(token):
+                if token.type == 'NAME':
+                    emit(token)
+                emit(token)
+            return push
+
+        @builder.add_adapter
+        def drop_eof(tokens):
+            for token in tokens:
+                if token.type != 'EOF':
+                    yield token
+
+    test.equal(
+        list(lexer.lex_string('a a b')),
+        [
+            Token(None, 'NAME', 'a'),
+            Token(None, 'NAME', 'a'),
+            Token(None, 'NAME', 'b'),
+            Token(None, 'NAME', 'b'),
+        ]
+    )
+
+
+@test.case
+def test_source_from_path():
+    import tempfile
+
+    @Lexer.new
+    def lexer(builder):
+        @builder.add(r'\s+')
+        def spaces(m, mark):
+            return ()
+
+        @builder.add(r'\w+')
+        def name(m, mark):
+            return [Token(mark, 'NAME', m.group())]
+
+    def lex_path(contents, **kwargs):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'data.txt')
+            with open(path, 'wb') as f:
+                f.write(contents)
+            source = Source.from_path(path, **kwargs)
+            tokens = list(lexer.lex(source))
+            return source, tokens, [
+                (token.mark.start, token.mark.end) for token in tokens
+            ]
+
+    text = 'foo bar\n  baz\n'
+    expected = list(lexer.lex_string(text))
+    expected_spans = [
+        (token.mark.start, token.mark.end) for token in expected
+    ]
+    for use_mmap in (True, False):
+        source, tokens, spans = lex_path(
+            text.encode('ascii'),
+            use_mmap=use_mmap,
+        )
+        test.that(not isinstance(source.data, str))
+        test.equal(tokens, expected)
+        test.equal(spans, expected_spans)
+        test.that(all(type(token.value) is str for token in tokens))
+        test.equal(
+            tokens[2].mark.info.replace(source.path, '<string>'),
+            expected[2].mark.info,
+        )
+        test.equal(source.text, text)
+
+    # Non-ASCII data and carriage returns are decoded up front
+    source, tokens, _ = lex_path('x\r\nété y'.encode('utf-8'))
+    test.equal(source.data, 'x\nété y')
+    test.equal(
+        [token.value for token in tokens],
+        ['x', 'été', 'y', 'EOF'],
+    )
+
+    source, tokens, _ = lex_path(b'')
+    test.equal(tokens, [Token(None, 'EOF', None)])
+
+
+def _lex_in_both_modes(lexer, s):
+    """Lexes s both as a str and as UTF-8 bytes, checking that both
+    give the same tokens with the same marks (or the same error)
+    """
+    def lex(source):
+        try:
+            tokens = list(lexer.lex(source))
+        except Error as e:
+            return None, e
+        return tokens, [
+            (token.mark.start, token.mark.end, token.mark.main)
+            for token in tokens
+        ]
+
+    source = Source.from_string(s)
+    bytes_source = Source.from_bytes(s.encode('utf-8'), path=source.path)
+    tokens, marks_or_error = lex(source)
+    bytes_tokens, bytes_marks_or_error = lex(bytes_source)
+    if tokens is None:
+        test.equal(type(bytes_marks_or_error), type(marks_or_error))
+        test.equal(str(bytes_marks_or_error), str(marks_or_error))
+        raise marks_or_error
+    test.equal(bytes_tokens, tokens)
+    test.equal(bytes_marks_or_error, marks_or_error)
+    return iter(tokens)
+
+
+@test.case
+def test_bytes_mode_matches_str_mode():
+    from mtots.nc import lexer as nc_lexer
+    from mtots.python import lexer as python_lexer
+    from mtots.text.barley import lexer as barley_lexer
+    from mtots.text.java import lexer as java_lexer
+    python_samples = [
+        '',
+        '\n# Some comments\ndef foo(\n\n        ):\n    pass\n',
+        '(\n    """hi""" \'\'\'world\'\'\'\n)',
+        '\nfoo\n    bar',
+        'x = 0x1F + 1.5e3 - 7\n',
+        's = "a\\n\\"b\\"" + \'c\'\n',
+        'if x:\n    y\n  z\n',
+        '( ]',
+        'x = $\n',
+    ]
+    samples = [
+        (nc_lexer, [
+            '',
+            '\n(\n)[\n]{\n}',
+            '({\n})',
+            'int main() = foo(1, 2.5, "hi\\n")\n',
+            'class Foo {\n  // comment\n  int x\n}\n',
+            '( ]',
+            ']',
+            '"unterminated',
+            '?',
+        ]),
+        (python_lexer, python_samples),
+        (barley_lexer, python_samples),
+        (java_lexer, [
+            'null true false hi for',
+            '// this is a comment\nhi\n',
+            '/* this is a comment\n * block\n */ x',
+            'int x = 0x1F + 1.5 - \'c\';',
+            'String s = "a\\"b\\n";',
+            '#',
+        ]),
+    ]
+    for module, module_samples in samples:
+        test.that(module.lexer._get_bytes_patterns(), module.__name__)
+        for sample in module_samples:
+            try:
+                _lex_in_both_modes(module.lexer, sample)
+            except Error:
+                pass
+
+    lexer = nc_lexer.lexer
+    test.that(
+        not isinstance(Source.from_bytes(b'x = 1\r\n').data, str))
+    test.that(isinstance(Source.from_bytes('é'.encode('utf-8')).data, str))
+    _lex_in_both_modes(lexer, 'x = 1\r\n')
+    _lex_in_both_modes(lexer, 'x = "\x1c é"\n')
+    test.equal(
+        [token.value for token in lexer.lex_bytes(b'foo(1, 2.5)')],
+        ['foo', '(', 1, ',', 2.5, ')', 'EOF'],
+    )
@@ -7,6 +7,7 @@ from .base import Success
 from .base import TokenStream
 from mtots import test
 from mtots.util.dataclasses import dataclass
+from mtots.util.memoizer import memoize
 from mtots.util.typing import Callable
 from mtots.util.typing import Iterable
 from mtots.util.typing import List
@@ -26,6 +27,9 @@ _sentinel = object()
 
 class Parser(abc.ABC):
 
+    # Cached by _get_toplevel_parser
+    _toplevel_parser = None
+
     @staticmethod
     def ensure_parser(s):
         if isinstance(s, Parser):
@@ -92,20 +96,26 @@ class Parser(abc.ABC):
 
     def required(self):
         """Throw exception on failed match
-        """
 
-        def require(match):
-            raise match.to_error()
-
-        return self.recover(require)
+        If the stream is in error-recovery mode (see Recovery),
+        the error is recorded instead, and parsing continues
+        with an error node in place of the failed match.
+        """
+        return _Required(self)
 
     def map(self, f):
 
         @functools.wraps(f)
         def g(match_result):
-            return Success(match_result.mark, f(match_result.value))
+            if match_result:
+                return Success(match_result.mark, f(match_result.value))
+            else:
+                return match_result
 
-        return self.xmap(g)
+        # Error nodes (see Recovery) pass through maps untouched
+        g.passes_error_nodes = True
+
+        return self.allmap(g)
 
     def valmap(self, value):
         return self.map(lambda x: value)
@@ -318,6 +328,15 @@ def Struct(constructor, patterns, *, include_mark=False):
         try:
             return constructor(**kwargs)
         except TypeError as e:
+            # In error-recovery mode, some fields may be error nodes
+            # that the constructor doesn't accept.
+            # In that case, this whole struct becomes an error node.
+            error_node = _find_error_node(list(kwargs.values()))
+            if error_node is not None:
+                return type(error_node)(
+                    mark=kwargs.get('mark', m.mark),
+                    message=error_node.message,
+                )
             raise TypeError(f'{constructor} construction failure') from e
 
     return All(*parsers).fatmap(callback)
@@ -327,8 +346,124 @@ def Required(pattern):
     return Any(pattern).required()
 
 
-def _apply_callbacks(mark, result, callbacks):
+@dataclass(frozen=True)
+class Recovery:
+    """Settings for parsing in error-recovery mode.
+
+    When a Required parser fails in recovery mode, the error is recorded,
+    tokens are skipped up to (but not including) the next token whose
+    type is in sync_types, and an error_node_type node spanning the
+    skipped tokens is used as the value of the failed parser.
+
+    If a Struct cannot be constructed because one of its fields contains
+    an error node, the Struct itself becomes an error node.
+    That way, errors bubble up to the nearest place in the tree
+    where an error node is acceptable.
+    """
+    sync_types: typing.Tuple[str, ...] = ('NEWLINE', '}', ')')
+    error_node_type: type = base.ErrorNode
+
+
+class _Required(Parser):
+    def __init__(self, parser):
+        self.parser = parser
+
+    def match(self, stream):
+        result = self.parser.match(stream)
+        if result:
+            return result
+        if stream.recovery is None:
+            raise result.to_error()
+        return _recover(stream, result)
+
+    def __str__(self):
+        return f'Required({self.parser})'
+
+
+class SkipUnexpected(Parser):
+    """Catch-all for tokens where nothing else could start.
+
+    Outside of error-recovery mode this never matches.
+    In error-recovery mode (see Recovery), it matches any token but EOF:
+    the error is recorded, and that token and everything up to the next
+    sync token are skipped and replaced with an error node.
+    This is meant as the last alternative of a repeated statement,
+    so that e.g. a stray closing symbol left behind by another
+    recovery does not end the whole parse.
+    """
+
+    def match(self, stream):
+        token = stream.peek
+        failure = Failure(token.mark, f'Unexpected {token.type}')
+        if stream.recovery is None or token.type == 'EOF':
+            return failure
+        return _recover(stream, failure, skip_first=True)
+
+    def __str__(self):
+        return 'SkipUnexpected()'
+
+
+def _recover(stream, failure, *, skip_first=False):
+    recovery = stream.recovery
+
+    # The same failure may be hit more than once while backtracking.
+    # Failures right where the last recovery left off are most likely
+    # caused by that error, so those aren't reported either.
+    error_key = (failure.mark.start, failure.mark.end, failure.message)
+    if (error_key not in stream._error_keys and
+            stream.state != stream._last_recovery_state):
+        stream._error_keys.add(error_key)
+        stream.errors.append(failure.to_error())
+
+    start_mark = stream.peek.mark
+    sync_types = recovery.sync_types
+    if skip_first:
+        next(stream)
+    while (stream.peek.type != 'EOF' and
+            stream.peek.type not in sync_types):
+        next(stream)
+    stream._last_recovery_state = stream.state
+    mark = base.Mark(
+        start_mark.source,
+        start_mark.start,
+        stream.peek.mark.start,
+    )
+    return Success(mark, recovery.error_node_type(
+        mark=mark,
+        message=failure.message,
+    ))
+
+
+def _find_error_node(value):
+    if isinstance(value, base.ErrorNode):
+        return value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            error_node = _find_error_node(item)
+            if error_node is not None:
+                return error_node
+    return None
+
+
+def _apply_callbacks(stream, mark, result, callbacks):
+    if stream.recovery is not None:
+        return _apply_callbacks_with_recovery(mark, result, callbacks)
+    for f in callbacks:
+        result = f(result)
+        if not isinstance(result, MatchResult):
+            raise base.ParseError(
+                [mark],
+                f'AllMap callback returned '
+                f'non-MatchResult {repr(result)}')
+    return result
+
+
+def _apply_callbacks_with_recovery(mark, result, callbacks):
     for f in callbacks:
+        if (result and
+                isinstance(result.value, base.ErrorNode) and
+                getattr(f, 'passes_error_nodes', False)):
+            continue
         result = f(result)
         if not isinstance(result, MatchResult):
             raise base.ParseError(
@@ -354,7 +489,7 @@ class AllMap(Parser):
     def match(self, stream):
         mark = stream.peek.mark
         result = self.parser.match(stream)
-        return _apply_callbacks(mark, result, self.callbacks)
+        return _apply_callbacks(stream, mark, result, self.callbacks)
 
     def __str__(self):
         return (
@@ -508,7 +643,12 @@ class _DirectLeftRecursive(Parser):
     def match(self, stream):
         start_mark = stream.peek.mark
         result = self.base_parser.match(stream)
-        result = _apply_callbacks(result.mark, result, self.outer_callbacks)
+        result = _apply_callbacks(
+            stream,
+            result.mark,
+            result,
+            self.outer_callbacks,
+        )
 
         # WARNING: Pardon the spahgetti code...
         while result:
@@ -517,6 +657,7 @@ class _DirectLeftRecursive(Parser):
             for triple in self.recurse_triples:
                 first_callbacks, postfix_parsers, alt_callbacks = triple
                 first_callbacks_result = _apply_callbacks(
+                    stream,
                     result.mark,
                     result,
                     first_callbacks,
@@ -547,6 +688,7 @@ class _DirectLeftRecursive(Parser):
                         middle_mark.start,
                     )
                     new_result = _apply_callbacks(
+                        stream,
                         result_mark,
                         Success(result_mark, subvalues),
                         tuple(alt_callbacks) + self.outer_callbacks,
@@ -590,28 +732,171 @@ class Repeat(Parser):
                 stream.state = state
                 return result
         for _ in range(self.min, self.max):
+            last_state = stream.state
             result = parser.match(stream)
             if result:
                 values.append(result.value)
             else:
                 break
+            if stream.state == last_state:
+                # The parser matched without consuming anything,
+                # (e.g. an error node in error-recovery mode)
+                # so trying again would just loop forever.
+                break
         return Success(mark, values)
 
     def __str__(self):
         return f'Repeat({self.parser}, {self.min}, {self.max})'
 
 
-def parse_pattern(*, pattern, data, path, lexer):
-    source = base.Source(data=data, path=path)
-    tokens = lexer.lex(source)
-    match_result = All(pattern, Peek('EOF')).getitem(0).parse(tokens)
+def _get_toplevel_parser(pattern):
+    """Returns a parser that matches pattern followed by EOF.
+    It is cached on the pattern itself, so it lives as long as the pattern.
+    """
+    pattern = Parser.ensure_parser(pattern)
+    parser = pattern._toplevel_parser
+    if parser is None:
+        parser = All(pattern, Peek('EOF')).getitem(0)
+        pattern._toplevel_parser = parser
+    return parser
+
+
+def _parse_source(parser, stream, source, lexer):
+    stream.reset(lexer.lex(source))
+    match_result = parser.match(stream)
     if not match_result:
         raise match_result.to_error()
     return match_result.value
 
 
-@base.Lexer.new
-def test_lexer(lexer):
+def parse_pattern(*, pattern, data, path, lexer, recovery=None):
+    """Parse data with pattern, requiring that all input is consumed.
+
+    If recovery is None, the first error is raised.
+    Otherwise parsing continues past errors (see Recovery), and
+    a (value, errors) pair is returned, where value is the possibly
+    partial result (or None), and errors is the list of base.Errors
+    found (lex errors first, then parse errors in the order they were
+    found). In this mode, lexer.lex must accept an 'errors' list.
+    """
+    return parse_source(
+        pattern=pattern,
+        source=base.Source(data=data, path=path),
+        lexer=lexer,
+        recovery=recovery,
+    )
+
+
+def parse_source(*, pattern, source, lexer, recovery=None):
+    """Like parse_pattern, but for an already built base.Source,
+    e.g. one from base.Source.from_path
+    """
+    if recovery is None:
+        return _parse_source(
+            _get_toplevel_parser(pattern),
+            TokenStream(()),
+            source,
+            lexer,
+        )
+
+    # The lexer must accept an errors list too, in which it collects
+    # recoverable lex errors (e.g. mismatched grouping symbols).
+    lex_errors = []
+    stream = TokenStream(lexer.lex(source, errors=lex_errors))
+    stream.recovery = recovery
+    stream.errors.extend(lex_errors)
+    match_result = pattern.match(stream)
+    if not match_result:
+        stream.errors.append(match_result.to_error())
+        return None, stream.errors
+    if stream.peek.type != 'EOF':
+        stream.errors.append(base.ParseError(
+            [stream.peek.mark],
+            f'Expected EOF but got {stream.peek.type}',
+        ))
+    return match_result.value, stream.errors
+
+
+def _resolve(reference):
+    """Resolves a 'module' or 'module:attribute' reference (see parse_many).
+    Anything other than a str is returned as is.
+    """
+    if not isinstance(reference, str):
+        return reference
+    import importlib
+    module_name, _, attribute_path = reference.partition(':')
+    value = importlib.import_module(module_name)
+    for name in attribute_path.split('.') if attribute_path else ():
+        value = getattr(value, name)
+    return value
+
+
+def _parse_many_sources(pattern, sources, lexer):
+    if isinstance(pattern, str) and ':' in pattern:
+        pattern = _resolve(pattern)
+    lexer = _resolve(lexer)
+    parser = _get_toplevel_parser(pattern)
+    stream = TokenStream(())
+    results = []
+    for source in sources:
+        try:
+            results.append(_parse_source(parser, stream, source, lexer))
+        except base.Error as e:
+            results.append(e)
+    return results
+
+
+def parse_many(pattern, sources, lexer, *, executor=None, chunk_size=64):
+    """Parse many (usually small) sources with the same pattern.
+
+    sources may contain base.Source objects or plain strings.
+    Returns a list with one entry per source: either the parsed value,
+    or the base.Error that was raised while lexing/parsing it.
+
+    All sources share the same top level parser, and every batch reuses
+    a single TokenStream (and its cache).
+
+    pattern may also be given as a 'module:attribute' reference
+    (any other str is a token type, as everywhere else), and lexer as
+    a 'module:attribute' or just 'module' reference. References are
+    imported where the sources are parsed.
+    If a concurrent.futures executor is given, sources are split into
+    batches of chunk_size that are parsed on the executor.
+    Grammars are generally not picklable (they are full of lambdas),
+    so for a ProcessPoolExecutor, pass references, e.g.
+
+        parse_many('mtots.nc.parser:file_', sources, 'mtots.nc.lexer',
+                   executor=executor)
+
+    so that each worker process builds the grammar itself.
+    """
+    sources = [
+        source if isinstance(source, base.Source) else
+        base.Source.from_string(source)
+        for source in sources
+    ]
+    if executor is None:
+        return _parse_many_sources(pattern, sources, lexer)
+    chunks = [
+        sources[i:i + chunk_size]
+        for i in range(0, len(sources), chunk_size)
+    ]
+    futures = [
+        executor.submit(_parse_many_sources, pattern, chunk, lexer)
+        for chunk in chunks
+    ]
+    return [result for future in futures for result in future.result()]
+
+
+@memoize
+def test_lexer():
+    """Lexer used by the tests below.
+    Built on first use so that importing this module stays cheap.
+    """
+    return base.Lexer.new(_build_test_lexer)
+
+
+def _build_test_lexer(lexer):
     @lexer.add('\s+')
     def spaces(m, mark):
         return ()
@@ -650,7 +935,7 @@ def test_sample_parser():
     prog = All(expr.repeat(), 'EOF').map(lambda args: args[0])
 
     def parse(text):
-        return prog.parse(test_lexer.lex_string(text))
+        return prog.parse(test_lexer().lex_string(text))
 
     test.equal(
         parse("""
@@ -673,7 +958,7 @@ def test_left_recursive_grammar():
     expr = addexpr
 
     def parse(text):
-        return expr.parse(test_lexer.lex_string(text))
+        return expr.parse(test_lexer().lex_string(text))
 
     test.equal(
         parse("1 + 2 + 3"),
@@ -698,7 +983,7 @@ def test_simple_arithmetic_grammar():
     ))
 
     def parse(text):
-        return expr.parse(test_lexer.lex_string(text))
+        return expr.parse(test_lexer().lex_string(text))
 
     test.equal(
         parse('1 + 2 - 7 * 2'),
@@ -729,7 +1014,7 @@ def test_join():
     expr_list = All('(', expr.join(','), ')').map(lambda args: args[1])
 
     def parse(text):
-        return expr_list.parse(test_lexer.lex_string(text))
+        return expr_list.parse(test_lexer().lex_string(text))
 
     test.equal(
         parse('()'),
@@ -765,7 +1050,7 @@ def test_struct():
     ])
 
     def parse(parser, text):
-        return parser.parse(test_lexer.lex_string(text))
+        return parser.parse(test_lexer().lex_string(text))
 
     test.equal(
         parse(foo_parser, "924 + hi"),
@@ -792,3 +1077,99 @@ def test_struct():
         Success(None, Bar(m.value.mark, 924, 'hi')),
     )
 
+
+
+@test.case
+def test_parse_many():
+    atom = Any('NAME', 'NUMBER')
+    addexpr = Forward(name='addexpr', parser_factory=lambda: Any(
+        All(addexpr, '+', atom).map(lambda args: args[0] + args[2]),
+        atom,
+    ))
+    sources = ['1 + 2', '3', '4 + ', '5 + 6 + 7', '&']
+
+    def check(results):
+        test.equal(len(results), len(sources))
+        test.equal(results[0], 3)
+        test.equal(results[1], 3)
+        test.that(isinstance(results[2], base.Error))
+        test.equal(results[3], 18)
+        test.that(isinstance(results[4], base.LexError))
+
+    check(parse_many(addexpr, sources, test_lexer()))
+
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        check(parse_many(
+            addexpr,
+            sources,
+            test_lexer(),
+            executor=executor,
+            chunk_size=2,
+        ))
+
+
+@test.case
+def test_string_pattern():
+    # A plain str is a token type, like anywhere else a parser is expected
+    test.equal(
+        parse_pattern(
+            pattern='NAME', data='abc', path='x', lexer=test_lexer()),
+        'abc',
+    )
+    results = parse_many('NUMBER', ['1', 'abc'], test_lexer())
+    test.equal(results[0], 1)
+    test.that(isinstance(results[1], base.Error))
+
+
+@test.case
+def test_error_recovery():
+
+    class Assignment(typing.NamedTuple):
+        name: str
+        value: float
+
+    def make_assignment(**kwargs):
+        if not isinstance(kwargs['value'], float):
+            raise TypeError('value must be a float')
+        return Assignment(**kwargs)
+
+    statement = Struct(make_assignment, [
+        ['name', 'NAME'],
+        Required('+'),
+        ['value', Required('NUMBER')],
+        Required(','),
+    ])
+    statements = statement.repeat()
+
+    def parse(text, recovery):
+        return parse_pattern(
+            pattern=statements,
+            data=text,
+            path='<test>',
+            lexer=test_lexer(),
+            recovery=recovery,
+        )
+
+    text = 'a + 1, b + c, d 2, e + 3,'
+
+    @test.throws(base.Error, """Expected NUMBER but got NAME
+<test> line 1
+a + 1, b + c, d 2, e + 3,
+           *
+""")
+    def without_recovery():
+        parse(text, None)
+
+    value, errors = parse(text, Recovery(sync_types=(',',)))
+    test.equal(
+        [str(e).splitlines()[0] for e in errors],
+        [
+            'Expected NUMBER but got NAME',
+            "Expected + but got NUMBER",
+        ],
+    )
+    test.equal(value[0], Assignment('a', 1.0))
+    test.that(isinstance(value[1], base.ErrorNode))
+    test.that(isinstance(value[2], base.ErrorNode))
+    test.equal(value[3], Assignment('e', 3.0))
@@ -142,46 +142,54 @@ def lexer(builder):
     def separators_and_operators(m, mark):
         return [base.Token(mark, m.group(), None)]
 
-    @builder.add_adapter
-    def remove_nested_newlines_adapter(tokens):
+    openers = frozenset(('(', '{', '['))
+    closers = frozenset((']', '}', ')'))
+
+    @builder.add_filter
+    def remove_nested_newlines_filter(emit, report):
         depth = 0
-        openers = ('(', '{', '[')
-        closers = (']', '}', ')')
-        for token in tokens:
-            if token.type in openers:
+
+        def push(token):
+            nonlocal depth
+            type_ = token.type
+            if type_ in openers:
                 depth += 1
-            elif token.type in closers:
+            elif type_ in closers:
                 depth -= 1
-            elif token.type == 'NEWLINE' and depth > 0:
-                continue
-            yield token
+            elif type_ == 'NEWLINE' and depth > 0:
+                return
+            emit(token)
 
-    @builder.add_adapter
-    def process_indents_adapter(tokens):
+        return push
+
+    @builder.add_filter
+    def process_indents_filter(emit, report):
         stack = ['']
-        for token in tokens:
 
+        def push(token):
             if token.type == 'EOF':
                 while len(stack) > 1:
                     stack.pop()
-                    yield base.Token(token.mark, 'DEDENT', None)
+                    emit(base.Token(token.mark, 'DEDENT', None))
 
             if token.type == 'NEWLINE':
-                yield base.Token(token.mark, 'NEWLINE', None)
+                emit(base.Token(token.mark, 'NEWLINE', None))
                 indent = token.value
                 if indent != stack[-1]:
                     if indent.startswith(stack[-1]):
-                        yield base.Token(token.mark, 'INDENT', None)
+                        emit(base.Token(token.mark, 'INDENT', None))
                         stack.append(indent)
                     elif stack[-1].startswith(indent):
                         while (stack[-1] != indent and
                                 stack[-1].startswith(indent)):
                             stack.pop()
-                            yield base.Token(token.mark, 'DEDENT', None)
+                            emit(base.Token(token.mark, 'DEDENT', None))
                 if indent != stack[-1]:
                     raise base.Error([token.mark], 'Invalid indent')
             else:
-                yield token
+                emit(token)
+
+        return push
 
 
 def lex_string(s: str):
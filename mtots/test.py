@@ -1,25 +1,26 @@
 """
 Utility for testing code in mtots
+
+Almost every module in mtots imports this module, so anything that is
+only needed for actually running tests (e.g. argparse, traceback)
+is imported lazily inside the functions that need them.
+Registering a test case is just a dict append; the body of the test
+does not run until run_tests is called.
 """
-from . import module_finder
-import argparse
 import collections
-import importlib
-import inspect
-import os
 import sys
 import time
-import traceback
 
 
 _tests_table = collections.defaultdict(lambda: [])
 
 _slow_tests = set()
 
+_benchmarks_table = collections.defaultdict(lambda: [])
+
 
 def case(f, slow=False):
-    module = inspect.getmodule(f)
-    module_name = module.__name__
+    module_name = f.__module__
     _tests_table[module_name].append(f)
     if slow:
         _slow_tests.add(f)
@@ -29,6 +30,24 @@ def slow(f):
     return case(f, slow=True)
 
 
+def bench(f=None, *, warmup=3, repeat=20):
+    """Registers a benchmark.
+    Benchmarks are not run as tests, but only with '--bench',
+    where f is called warmup times, and then timed for repeat calls.
+
+    Can be used either as @bench or as @bench(repeat=100)
+    """
+    def register(f):
+        f.bench_warmup = warmup
+        f.bench_repeat = repeat
+        _benchmarks_table[f.__module__].append(f)
+
+    if f is None:
+        return register
+    else:
+        return register(f)
+
+
 def equal(a, b):
     if not (a == b):
         raise AssertionError(f'Expected {a} to equal {b}')
@@ -52,59 +71,463 @@ def throws(exc_type, message=None):
             equal(message, actual_message)
     return wrapper
 
-def run_tests(pkg, run_slow_tests=False):
+# Result of importing a module and running all of its tests.
+#   output: everything the run printed, if it was captured
+#     (i.e. when it ran in a worker process), otherwise None
+#   import_failed: True if the module could not be imported
+#   test_results: list of (full_test_name, status, duration) triples,
+#     where status is one of 'PASS', 'FAIL' or 'SKIP'
+#   dependencies: dict mapping the names of the modules that the module
+#     depends on (including itself) to the hashes of their sources,
+#     or None if the module could not be imported
+ModuleResult = collections.namedtuple(
+    'ModuleResult',
+    ['module_name', 'output', 'import_failed', 'test_results',
+     'dependencies'],
+)
+
+DEFAULT_CACHE_PATH = '.mtots-test-cache.json'
+
+_CACHE_VERSION = 3
+
+_source_hashes = {}
+
+
+def _file_hash(path):
+    import hashlib
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except (OSError, TypeError):
+        return None
+
+
+def _source_hash(module_name):
+    if module_name not in _source_hashes:
+        import importlib.util
+        module = sys.modules.get(module_name)
+        if module is not None:
+            path = getattr(module, '__file__', None)
+        else:
+            try:
+                spec = importlib.util.find_spec(module_name)
+            except (ImportError, ValueError):
+                spec = None
+            path = None if spec is None else spec.origin
+        _source_hashes[module_name] = _file_hash(path)
+    return _source_hashes[module_name]
+
+
+def _find_dependencies(root, module_names):
+    """Find all the modules in the package root that the given
+    (already imported) modules depend on.
+
+    A module depends on every module (or module of a class or function)
+    that appears in its globals other than its own submodules,
+    on its parent packages, and on the dependencies of those in turn.
+    Imports that happen inside functions only show up here if the
+    caller passes them in (see the sys.modules delta in _run_module).
+    """
+    dependencies = set()
+    stack = list(module_names)
+    while stack:
+        module_name = stack.pop()
+        if (module_name in dependencies or not
+                (module_name == root or module_name.startswith(root + '.'))):
+            continue
+        module = sys.modules.get(module_name)
+        if module is None:
+            continue
+        dependencies.add(module_name)
+        if '.' in module_name:
+            stack.append(module_name.rpartition('.')[0])
+        for key, value in vars(module).items():
+            if isinstance(value, type(sys)):
+                name = value.__name__
+                if name == f'{module_name}.{key}':
+                    # Importing a submodule sets it as an attribute
+                    # of its package, but does not make the package
+                    # depend on it
+                    continue
+            else:
+                name = getattr(value, '__module__', None)
+            if isinstance(name, str):
+                stack.append(name)
+    return dependencies
+
+
+class _DependencyRecorder:
+    """Records the names of all modules imported by import statements
+    while active, including ones that were already imported before,
+    e.g. those imported lazily inside the functions being tested,
+    and the absolute paths of all files opened for reading,
+    e.g. data files that the tests parse.
+
+    Each opened file is attributed to every module whose code is on
+    the call stack at the time (other than this one), so that a module
+    that caches what it reads (like nc.resolver does with the prelude)
+    keeps the file as a dependency for the tests of other modules that
+    only ever see the cached result.
+    """
+
+    def __init__(self):
+        self.module_names = set()
+        # module name -> set of absolute paths
+        self.opened_files = collections.defaultdict(set)
+
+    def __enter__(self):
+        import builtins
+        self._original_import = builtins.__import__
+        self._original_open = builtins.open
+        builtins.__import__ = self._import
+        builtins.open = self._open
+        return self
+
+    def __exit__(self, *exc_info):
+        import builtins
+        builtins.__import__ = self._original_import
+        builtins.open = self._original_open
+
+    def _open(self, file, mode='r', *args, **kwargs):
+        import os
+        if (isinstance(file, (str, bytes, os.PathLike)) and
+                not any(c in mode for c in 'wax+')):
+            path = os.path.abspath(os.fsdecode(file))
+            frame = sys._getframe(1)
+            while frame is not None:
+                module_name = frame.f_globals.get('__name__')
+                if isinstance(module_name, str) and module_name != __name__:
+                    self.opened_files[module_name].add(path)
+                frame = frame.f_back
+        return self._original_open(file, mode, *args, **kwargs)
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module = self._original_import(name, globals, locals, fromlist, level)
+        if level:
+            package = (globals or {}).get('__package__') or ''
+            prefix = package.rsplit('.', level - 1)[0]
+            name = f'{prefix}.{name}' if name else prefix
+        self.module_names.add(name)
+        for item in fromlist or ():
+            self.module_names.add(f'{name}.{item}')
+        return module
+
+
+def _load_cache(cache_path):
+    """Returns the cache entries of the modules whose tests passed,
+    and the data files that each module was seen opening
+    """
+    import json
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}, {}
+    if cache.get('version') != _CACHE_VERSION:
+        return {}, {}
+    return cache['modules'], cache['opened_files']
+
+
+def _save_cache(cache_path, modules, opened_files):
+    import json
+    import os
+    tmp_path = f'{cache_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(
+            {
+                'version': _CACHE_VERSION,
+                'modules': modules,
+                'opened_files': opened_files,
+            },
+            f,
+            indent=1,
+            sort_keys=True,
+        )
+    os.replace(tmp_path, cache_path)
+
+
+def _dependency_file_paths(dependencies, opened_files):
+    return sorted({
+        path
+        for module_name in dependencies
+        for path in opened_files.get(module_name, ())
+    })
+
+
+def _new_cache_entry(skipped_slow_tests, dependencies, opened_files):
+    """Records the hashes of the given dependencies of a module whose
+    tests all passed, and of the data files that any of them open
+    """
+    return {
+        'skipped_slow_tests': skipped_slow_tests,
+        'dependencies': dependencies,
+        'files': {
+            path: _file_hash(path)
+            for path in _dependency_file_paths(dependencies, opened_files)
+        },
+    }
+
+
+def _is_unchanged(entry, run_slow_tests, opened_files):
+    """Checks whether a module whose tests all passed
+    when the cache entry was recorded can be skipped now.
+
+    Data files count if any dependency was ever seen opening them,
+    even if the module's own tests only got a cached result.
+    """
+    if run_slow_tests and entry['skipped_slow_tests']:
+        return False
+    for module_name, source_hash in entry['dependencies'].items():
+        if _source_hash(module_name) != source_hash:
+            return False
+    for path in _dependency_file_paths(entry['dependencies'], opened_files):
+        if _file_hash(path) != entry['files'].get(path):
+            return False
+    return True
+
+
+def _data_file_paths(root, file_paths):
+    """Select the files under the directory of the package root
+    that are not the source of a module, i.e. the data files
+    that a module's tests read.
+    """
+    import os
+    root_dir = os.path.dirname(os.path.abspath(sys.modules[root].__file__))
+    return sorted(
+        path for path in file_paths
+        if path.startswith(root_dir + os.sep) and
+        not path.endswith('.py') and
+        os.path.isfile(path)
+    )
+
+
+def _run_module(module_name, run_slow_tests, out, err, track_dependencies):
+    """Import module_name and run its tests.
+
+    Only if track_dependencies is set (i.e. for '--changed') are the
+    modules and data files that the module depends on recorded, along
+    with their hashes, in the dependencies of the result.
+    """
+    import importlib
+    import traceback
+
+    test_results = []
+    tests = _tests_table[module_name]
+    modules_before = set(sys.modules)
+    recorder = _DependencyRecorder() if track_dependencies else None
+    out.write(f'testing {module_name}...')
+    try:
+        import_start_time = time.time()
+        if recorder is None:
+            importlib.import_module(module_name)
+        else:
+            with recorder:
+                importlib.import_module(module_name)
+        import_end_time = time.time()
+        import_duration = import_end_time - import_start_time
+        out.write(
+            f' (import: {format(import_duration, ".2f")}s)',
+        )
+    except BaseException as e:
+        out.write(f' IMPORT FAILED\n')
+        traceback.print_exc(file=err)
+        return ModuleResult(module_name, None, True, test_results, None)
+    if tests:
+        out.write('\n')
+        for test in tests:
+            full_test_name = f'{module_name}.{test.__name__}'
+            out.write(f'  {test.__name__} ')
+            if not run_slow_tests and test in _slow_tests:
+                out.write('SKIP (skipping slow test)\n')
+                test_results.append((full_test_name, 'SKIP', 0.0))
+                continue
+            try:
+                test_start_time = time.time()
+                if recorder is None:
+                    test()
+                else:
+                    with recorder:
+                        test()
+                test_end_time = time.time()
+                test_duration = test_end_time - test_start_time
+                out.write(
+                    f'PASS ({format(test_duration, ".2f")}s)\n',
+                )
+                test_results.append((full_test_name, 'PASS', test_duration))
+            except BaseException as e:
+                traceback.print_exc(file=err)
+                out.write(f'FAIL\n')
+                test_results.append((full_test_name, 'FAIL', 0.0))
+    else:
+        out.write(f' no tests\n')
+
+    if recorder is None:
+        return ModuleResult(module_name, None, False, test_results, None)
+
+    # Modules imported for the first time while importing or testing
+    # this module are dependencies too, even if they were only
+    # imported inside a function, and so are modules that the tests
+    # imported inside a function after some earlier module loaded them
+    root = module_name.split('.')[0]
+    new_module_names = set(sys.modules) - modules_before
+    dependencies = {
+        'modules': {
+            dependency: _source_hash(dependency)
+            for dependency in sorted(_find_dependencies(
+                root,
+                new_module_names | recorder.module_names | {module_name},
+            ))
+        },
+        'opened_files': {
+            opener: _data_file_paths(root, paths)
+            for opener, paths in recorder.opened_files.items()
+            if opener == root or opener.startswith(root + '.')
+        },
+    }
+    return ModuleResult(
+        module_name, None, False, test_results, dependencies)
+
+
+def _run_module_in_worker(module_name, run_slow_tests, track_dependencies):
+    """Runs in a worker process of the pool used for '--jobs'.
+    Output is captured and sent back to the parent along with the
+    results, so that the parent can print it in a deterministic order.
+    """
+    import io
+    buffer = io.StringIO()
+    result = _run_module(
+        module_name, run_slow_tests, buffer, buffer, track_dependencies)
+    return result._replace(output=buffer.getvalue())
+
+
+def _iter_module_results(
+        module_names, run_slow_tests, jobs, track_dependencies):
+    if jobs <= 1:
+        for module_name in module_names:
+            yield _run_module(
+                module_name,
+                run_slow_tests,
+                sys.stdout,
+                sys.stderr,
+                track_dependencies,
+            )
+    else:
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            # Executor.map yields results in the order of module_names,
+            # regardless of the order in which they complete
+            yield from executor.map(
+                _run_module_in_worker,
+                module_names,
+                [run_slow_tests] * len(module_names),
+                [track_dependencies] * len(module_names),
+            )
+
+
+def select_shard(module_names, shard):
+    """Select the modules for shard (i, n), i.e. the i-th of n roughly
+    equally sized groups of modules (1 <= i <= n).
+    The same module list always splits into the same shards.
+    """
+    i, n = shard
+    if not 1 <= i <= n:
+        raise ValueError(f'Invalid shard {i}/{n}')
+    return tuple(
+        module_name
+        for index, module_name in enumerate(module_names)
+        if index % n == i - 1
+    )
+
+
+def run_tests(
+        pkg,
+        run_slow_tests=False,
+        *,
+        jobs=1,
+        shard=None,
+        cache_path=None,
+        exclude=(),
+        module_index_path=None):
+    """Run the tests in all modules under pkg.
+
+    If cache_path is given, modules whose tests all passed in an earlier
+    run are skipped if neither their source nor the source of any
+    module they depend on nor any data file their tests read
+    has changed since, and the results of this run are recorded there
+    for the next one.
+
+    exclude and module_index_path are passed on to module_finder.find.
+    """
+    from . import module_finder
+
     all_tests_count = 0
     all_modules_count = 0
     passed_tests_count = 0
     skipped_tests_count = 0
-    module_names = module_finder.find(pkg)
+    module_names = module_finder.find(
+        pkg,
+        exclude=exclude,
+        index_path=module_index_path,
+    )
+    if shard is not None:
+        module_names = select_shard(module_names, shard)
+    if cache_path is not None:
+        cache, opened_files = _load_cache(cache_path)
+        unchanged_module_names = [
+            module_name for module_name in module_names
+            if module_name in cache and
+            _is_unchanged(cache[module_name], run_slow_tests, opened_files)
+        ]
+        module_names = tuple(
+            module_name for module_name in module_names
+            if module_name not in unchanged_module_names
+        )
     failed_tests = []
     failed_imports = []
+    passed_results = []
     test_duration_table = {}
     all_tests_start_time = time.time()
-    for module_name in module_names:
+    for result in _iter_module_results(
+            module_names, run_slow_tests, jobs, cache_path is not None):
         all_modules_count += 1
-        tests = _tests_table[module_name]
-        sys.stdout.write(f'testing {module_name}...')
-        try:
-            import_start_time = time.time()
-            importlib.import_module(module_name)
-            import_end_time = time.time()
-            import_duration = import_end_time - import_start_time
-            sys.stdout.write(
-                f' (import: {format(import_duration, ".2f")}s)',
-            )
-        except BaseException as e:
-            sys.stdout.write(f' IMPORT FAILED\n')
-            traceback.print_exc()
-            failed_imports.append(module_name)
+        if result.output is not None:
+            sys.stdout.write(result.output)
+        if result.import_failed:
+            failed_imports.append(result.module_name)
             continue
-        if tests:
-            sys.stdout.write('\n')
-            for test in tests:
-                full_test_name = f'{module_name}.{test.__name__}'
-                sys.stdout.write(f'  {test.__name__} ')
-                if not run_slow_tests and test in _slow_tests:
-                    sys.stdout.write('SKIP (skipping slow test)\n')
-                    skipped_tests_count += 1
-                    continue
-                all_tests_count += 1
-                try:
-                    test_start_time = time.time()
-                    test()
-                    test_end_time = time.time()
-                    test_duration = test_end_time - test_start_time
-                    sys.stdout.write(
-                        f'PASS ({format(test_duration, ".2f")}s)\n',
-                    )
-                    passed_tests_count += 1
-                    test_duration_table[full_test_name] = test_duration
-                except BaseException as e:
-                    traceback.print_exc()
-                    sys.stdout.write(f'FAIL\n')
-                    failed_tests.append(full_test_name)
-        else:
-            sys.stdout.write(f' no tests\n')
+        for full_test_name, status, duration in result.test_results:
+            if status == 'SKIP':
+                skipped_tests_count += 1
+                continue
+            all_tests_count += 1
+            if status == 'PASS':
+                passed_tests_count += 1
+                test_duration_table[full_test_name] = duration
+            else:
+                failed_tests.append(full_test_name)
+        if cache_path is not None:
+            if result.import_failed or any(
+                    status == 'FAIL' for _, status, _ in result.test_results):
+                cache.pop(result.module_name, None)
+            else:
+                passed_results.append(result)
+            for opener, paths in result.dependencies['opened_files'].items():
+                opened_files[opener] = sorted(
+                    set(opened_files.get(opener, ())) | set(paths))
+    if cache_path is not None:
+        # Entries are only made once all modules ran, so that they
+        # include files that a dependency was first seen opening
+        # while some later module was tested
+        for result in passed_results:
+            cache[result.module_name] = _new_cache_entry(
+                any(
+                    status == 'SKIP'
+                    for _, status, _ in result.test_results
+                ),
+                result.dependencies['modules'],
+                opened_files,
+            )
+        _save_cache(cache_path, cache, opened_files)
     failed_tests_count = len(failed_tests)
     assert passed_tests_count + failed_tests_count == all_tests_count, (
         passed_tests_count,
@@ -120,8 +543,7 @@ def run_tests(pkg, run_slow_tests=False):
     all_tests_duration = all_tests_end_time - all_tests_start_time
     tests_by_duration = sorted(
         test_duration_table,
-        key=lambda test: test_duration_table[test],
-        reverse=True,
+        key=lambda test: (-test_duration_table[test], test),
     )
     print(f'10 slowest running tests:')
     for test_name in tests_by_duration[:10]:
@@ -133,6 +555,11 @@ def run_tests(pkg, run_slow_tests=False):
             f'{skipped_tests_count} slow tests skipped '
             '(rerun with --all to run them)'
         )
+    if cache_path is not None:
+        print(
+            f'{len(unchanged_module_names)} unchanged modules skipped '
+            f'(their tests passed in an earlier run)'
+        )
     print(f'{passed_imports_count}/{all_modules_count} imports succeeded')
     print(f'{passed_tests_count}/{all_tests_count} tests passed')
     if failed_tests or failed_imports:
@@ -153,7 +580,192 @@ def run_tests(pkg, run_slow_tests=False):
         return 0
 
 
+DEFAULT_BENCH_HISTORY_DIR = '.mtots-bench-history'
+
+DEFAULT_BENCH_THRESHOLD = 0.1
+
+# Number of past results to keep per benchmark
+_BENCH_HISTORY_LIMIT = 50
+
+# Number of most recent past results whose medians make up the baseline
+# that a new result is compared to
+_BENCH_BASELINE_RUNS = 5
+
+# Summary statistics of the timings of a benchmark, in nanoseconds
+BenchStats = collections.namedtuple(
+    'BenchStats',
+    ['mean', 'median', 'stddev', 'p95', 'count'],
+)
+
+
+def summarize(samples):
+    import math
+    import statistics
+    samples = sorted(samples)
+    if not samples:
+        raise ValueError('No samples to summarize')
+    return BenchStats(
+        mean=statistics.mean(samples),
+        median=statistics.median(samples),
+        stddev=statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        # nearest-rank percentile
+        p95=samples[max(0, math.ceil(0.95 * len(samples)) - 1)],
+        count=len(samples),
+    )
+
+
+def _machine_id():
+    import platform
+    return '-'.join([
+        platform.node() or 'unknown',
+        platform.machine() or 'unknown',
+        platform.python_implementation(),
+        platform.python_version(),
+    ])
+
+
+def _time_benchmark(f):
+    perf_counter_ns = time.perf_counter_ns
+    for _ in range(f.bench_warmup):
+        f()
+    samples = []
+    for _ in range(f.bench_repeat):
+        start = perf_counter_ns()
+        f()
+        samples.append(perf_counter_ns() - start)
+    return summarize(samples)
+
+
+def _compare_to_history(stats, past_results, threshold):
+    """Returns the relative change of the median from the baseline,
+    i.e. the median of the medians of the last few past results,
+    and whether that counts as a regression.
+
+    A single noisy run should not decide the outcome, so it is only
+    a regression if the median grew by more than the threshold, and
+    by more than both the spread (stddev) of this run's own samples
+    and the spread of the medians in the baseline.
+    """
+    import statistics
+    medians = [
+        result['median'] for result in past_results[-_BENCH_BASELINE_RUNS:]
+    ]
+    baseline = statistics.median(medians)
+    noise = max(
+        stats.stddev,
+        statistics.stdev(medians) if len(medians) > 1 else 0.0,
+    )
+    change = stats.median / baseline - 1
+    return change, (
+        change > threshold and stats.median - baseline > noise
+    )
+
+
+def _format_ns(ns):
+    for unit, scale in (('s', 1e9), ('ms', 1e6), ('us', 1e3)):
+        if ns >= scale:
+            return f'{ns / scale:.2f}{unit}'
+    return f'{ns:.0f}ns'
+
+
+def run_benchmarks(
+        pkg,
+        *,
+        history_dir=DEFAULT_BENCH_HISTORY_DIR,
+        threshold=DEFAULT_BENCH_THRESHOLD,
+        exclude=()):
+    """Run all benchmarks under pkg, and compare the median time of each
+    one to the median of the medians from the last few runs
+    on this machine.
+
+    Returns 1 if any benchmark failed, or got slower by more than
+    the given fraction (and by more than its own spread), otherwise 0.
+    """
+    from . import module_finder
+    import importlib
+    import json
+    import os
+    import traceback
+
+    history_path = os.path.join(history_dir, f'{_machine_id()}.json')
+    try:
+        with open(history_path) as f:
+            history = json.load(f)
+    except (OSError, ValueError):
+        history = {}
+
+    failed_benchmarks = []
+    regressions = []
+    for module_name in module_finder.find(pkg, exclude=exclude):
+        try:
+            importlib.import_module(module_name)
+        except BaseException as e:
+            traceback.print_exc()
+            failed_benchmarks.append(module_name)
+            continue
+        for benchmark in _benchmarks_table[module_name]:
+            full_name = f'{module_name}.{benchmark.__name__}'
+            try:
+                stats = _time_benchmark(benchmark)
+            except BaseException as e:
+                traceback.print_exc()
+                print(f'  {full_name.ljust(50)} FAIL')
+                failed_benchmarks.append(full_name)
+                continue
+            past_results = history.setdefault(full_name, [])
+            if past_results:
+                change, regressed = _compare_to_history(
+                    stats, past_results, threshold)
+                formatted_change = f'{change * 100:+.1f}%'
+                if regressed:
+                    formatted_change += ' REGRESSION'
+                    regressions.append(full_name)
+            else:
+                formatted_change = 'new'
+            print(
+                f'  {full_name.ljust(50)} '
+                f'mean={_format_ns(stats.mean).rjust(9)} '
+                f'median={_format_ns(stats.median).rjust(9)} '
+                f'stddev={_format_ns(stats.stddev).rjust(9)} '
+                f'p95={_format_ns(stats.p95).rjust(9)} '
+                f'{formatted_change}'
+            )
+            past_results.append(dict(stats._asdict(), time=time.time()))
+            del past_results[:-_BENCH_HISTORY_LIMIT]
+
+    os.makedirs(history_dir, exist_ok=True)
+    with open(history_path, 'w') as f:
+        json.dump(history, f, indent=1, sort_keys=True)
+
+    if failed_benchmarks:
+        print(f'The following {len(failed_benchmarks)} benchmarks failed')
+        for name in failed_benchmarks:
+            print(f'  {name}')
+    if regressions:
+        print(
+            f'The following {len(regressions)} benchmarks got more than '
+            f'{threshold * 100:.0f}% slower'
+        )
+        for name in regressions:
+            print(f'  {name}')
+    return 1 if failed_benchmarks or regressions else 0
+
+
+def _parse_shard(s):
+    import argparse
+    try:
+        i, n = map(int, s.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'Expected a shard of the form i/n but got {repr(s)}')
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(
+            f'Expected 1 <= i <= n for shard i/n but got {repr(s)}')
+    return i, n
+
+
 def main():
+    import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('pkg', default='mtots', nargs='?')
     parser.add_argument(
@@ -162,11 +774,293 @@ def main():
         action='store_true',
         help='If set, also runs slow tests',
     )
+    parser.add_argument(
+        '--jobs', '-j',
+        default=1,
+        type=int,
+        help='Number of worker processes to run test modules in',
+    )
+    parser.add_argument(
+        '--shard',
+        default=None,
+        type=_parse_shard,
+        help='Only run the i-th of n groups of modules (e.g. 2/4)',
+    )
+    parser.add_argument(
+        '--exclude',
+        default=[],
+        action='append',
+        help='Skip the given module or package (e.g. mtots.void); '
+             'may be repeated',
+    )
+    parser.add_argument(
+        '--module-index',
+        default=None,
+        help='Cache directory listings used to find modules in this file',
+    )
+    parser.add_argument(
+        '--bench',
+        default=False,
+        action='store_true',
+        help='Run benchmarks instead of tests',
+    )
+    parser.add_argument(
+        '--bench-history-dir',
+        default=DEFAULT_BENCH_HISTORY_DIR,
+        help='Where --bench keeps past results, one file per machine',
+    )
+    parser.add_argument(
+        '--bench-threshold',
+        default=DEFAULT_BENCH_THRESHOLD,
+        type=float,
+        help='With --bench, report a regression when a median time '
+             'grows by more than this fraction of the recent medians '
+             '(default: 0.1) and by more than the measurement noise',
+    )
+    parser.add_argument(
+        '--changed',
+        default=False,
+        action='store_true',
+        help='Skip modules whose tests passed in an earlier --changed run '
+             'if neither they nor their dependencies have changed since',
+    )
+    parser.add_argument(
+        '--cache-path',
+        default=DEFAULT_CACHE_PATH,
+        help='Where --changed keeps the results of earlier runs',
+    )
     args = parser.parse_args()
-    sys.exit(run_tests(args.pkg, run_slow_tests=args.all))
+    if args.bench:
+        sys.exit(run_benchmarks(
+            args.pkg,
+            history_dir=args.bench_history_dir,
+            threshold=args.bench_threshold,
+            exclude=args.exclude,
+        ))
+    sys.exit(run_tests(
+        args.pkg,
+        run_slow_tests=args.all,
+        jobs=args.jobs,
+        shard=args.shard,
+        cache_path=args.cache_path if args.changed else None,
+        exclude=args.exclude,
+        module_index_path=args.module_index,
+    ))
 
 
 if __name__ == '__main__':
     from mtots import test
     test.main()
 
+
+@case
+def test_select_shard():
+    module_names = ('a', 'b', 'c', 'd', 'e')
+    equal(select_shard(module_names, (1, 2)), ('a', 'c', 'e'))
+    equal(select_shard(module_names, (2, 2)), ('b', 'd'))
+    shards = [select_shard(module_names, (i, 3)) for i in (1, 2, 3)]
+    equal(sorted(sum(shards, ())), list(module_names))
+
+    @throws(ValueError)
+    def invalid_shard():
+        select_shard(module_names, (3, 2))
+
+
+@case
+def test_find_dependencies():
+    import mtots.nc.parser
+    dependencies = _find_dependencies('mtots', ['mtots.nc.parser'])
+    that('mtots.nc.parser' in dependencies)
+    that('mtots.nc.cst' in dependencies)
+    that('mtots.parser.combinator' in dependencies)
+    that('mtots.nc' in dependencies)
+    that('mtots.nc.resolver' not in dependencies)
+
+
+@case
+def test_module_finder_exclude():
+    from . import module_finder
+    usaco_modules = module_finder.find('mtots.contests.usaco')
+    that('mtots.contests.usaco.castle' in usaco_modules)
+    that('mtots.contests.usaco._testutil' not in usaco_modules)
+    equal(module_finder.find('mtots.contests'), usaco_modules)
+    equal(
+        module_finder.find('mtots.contests', exclude=['mtots.contests.usaco']),
+        (),
+    )
+    equal(
+        module_finder.find(
+            'mtots.contests',
+            exclude=['mtots.contests.usaco.castle'],
+        ),
+        tuple(
+            name for name in usaco_modules
+            if name != 'mtots.contests.usaco.castle'
+        ),
+    )
+    equal(
+        module_finder.find('mtots.util', exclude=['mtots.util']),
+        (),
+    )
+
+
+@case
+def test_module_finder_index():
+    from . import module_finder
+    import os
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pkg_dir = os.path.join(tmp_dir, 'pkg')
+        os.mkdir(pkg_dir)
+        for name in ('a.py', '_private.py', 'notes.txt'):
+            with open(os.path.join(pkg_dir, name), 'w'):
+                pass
+        os.mkdir(os.path.join(pkg_dir, 'sub'))
+        # Pin the directory's mtime, so that adding an entry below
+        # changes it even on file systems with a coarse clock
+        os.utime(pkg_dir, ns=(10 ** 9, 10 ** 9))
+
+        index_path = os.path.join(tmp_dir, 'index.json')
+        index = module_finder._Index(index_path)
+        equal(index.list_directory(pkg_dir), (['a'], ['sub']))
+        that(index.dirty)
+
+        # While the mtime is unchanged, the cached listing is reused
+        # (without looking at the directory's entries again)
+        index.listings[pkg_dir][1] = ['cached']
+        equal(index.list_directory(pkg_dir), (['cached'], ['sub']))
+
+        # Adding an entry changes the mtime, so the listing is refreshed
+        with open(os.path.join(pkg_dir, 'b.py'), 'w'):
+            pass
+        modules, directories = index.list_directory(pkg_dir)
+        equal((sorted(modules), directories), (['a', 'b'], ['sub']))
+
+        # Round trip through the index file
+        index.save()
+        loaded = module_finder._Index(index_path)
+        equal(loaded.listings, index.listings)
+        that(not loaded.dirty)
+        equal(loaded.list_directory(pkg_dir), (modules, directories))
+        that(not loaded.dirty)
+
+        # An index from another version is ignored
+        with open(index_path, 'w') as f:
+            f.write('{"version": -1, "listings": {}}')
+        equal(module_finder._Index(index_path).listings, {})
+
+        # find gives the same result with or without an index
+        equal(
+            module_finder.find('mtots.contests', index_path=index_path),
+            module_finder.find('mtots.contests'),
+        )
+
+
+@case
+def test_compare_to_history():
+    def result(median):
+        return {'median': median}
+
+    def stats(median, stddev):
+        return BenchStats(
+            mean=median, median=median, stddev=stddev, p95=median, count=20)
+
+    # One noisy fast run in the history does not make the baseline
+    history = [result(m) for m in (100, 102, 98, 101, 80)]
+    change, regressed = _compare_to_history(stats(109, 1), history, 0.1)
+    that(abs(change - 0.09) < 1e-9)
+    that(not regressed)
+    equal(_compare_to_history(stats(115, 1), history, 0.1)[1], True)
+
+    # Only the most recent results make up the baseline
+    history = [result(1000)] * 10 + history
+    equal(_compare_to_history(stats(115, 1), history, 0.1)[1], True)
+
+    # Growth within the run's own spread is noise, and so is growth
+    # within the spread of the recent medians
+    equal(_compare_to_history(stats(115, 20), history, 0.1)[1], False)
+    history = [result(m) for m in (100, 150, 100, 150, 100)]
+    equal(_compare_to_history(stats(120, 1), history, 0.1)[1], False)
+    equal(_compare_to_history(stats(200, 0), [result(100)], 0.1)[1], True)
+
+
+@case
+def test_summarize():
+    stats = summarize([5, 1, 4, 2, 3])
+    equal(stats.mean, 3)
+    equal(stats.median, 3)
+    equal(stats.p95, 5)
+    equal(stats.count, 5)
+    that(abs(stats.stddev - 1.5811) < 1e-4)
+    equal(summarize(range(1, 101)).p95, 95)
+    equal(summarize([7]).stddev, 0.0)
+
+
+@case
+def test_dependency_recorder():
+    import os
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'data.txt')
+        with open(path, 'w') as f:
+            f.write('old')
+        with _DependencyRecorder() as recorder:
+            from mtots.parser import base
+            base.Source.from_path(path)
+            with open(os.path.join(tmp_dir, 'out.txt'), 'w'):
+                pass
+        that('mtots.parser.base' in recorder.module_names)
+        equal(recorder.opened_files['mtots.parser.base'], {path})
+        that(all(
+            paths == {path} for paths in recorder.opened_files.values()))
+
+        # Data files are part of the cache entry, so that editing one
+        # reruns the tests that read it
+        opened_files = {'mtots.parser.base': [path]}
+        entry = _new_cache_entry(
+            False,
+            {'mtots.parser.base': _source_hash('mtots.parser.base')},
+            opened_files,
+        )
+        that(_is_unchanged(entry, False, opened_files))
+        with open(path, 'w') as f:
+            f.write('new')
+        that(not _is_unchanged(entry, False, opened_files))
+
+
+@case
+def test_dependency_recorder_with_cached_parse():
+    import os
+    import tempfile
+    from mtots.nc import resolver
+    resolver._parse_cache.clear()
+    with _DependencyRecorder() as first:
+        resolver.load('int main() = 0\n')
+    with _DependencyRecorder() as second:
+        resolver.load('int main() = 0\n')
+    prelude_path = os.path.abspath(
+        resolver._import_path_to_file_path('_prelude'))
+    that(prelude_path in first.opened_files['mtots.nc.resolver'])
+    that(prelude_path in first.opened_files['mtots.nc.parser'])
+    equal(dict(second.opened_files), {})
+
+    # A module whose tests only got the cached parse still depends
+    # on the file through nc.resolver
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, '_prelude.nc')
+        with open(path, 'w') as f:
+            f.write('old')
+        opened_files = {'mtots.nc.resolver': [path]}
+        dependencies = {
+            'mtots.nc.daemon': _source_hash('mtots.nc.daemon'),
+            'mtots.nc.resolver': _source_hash('mtots.nc.resolver'),
+        }
+        entry = _new_cache_entry(False, dependencies, opened_files)
+        that(_is_unchanged(entry, False, opened_files))
+        with open(path, 'a') as f:
+            f.write('class Broken {')
+        that(not _is_unchanged(entry, False, opened_files))
+
+        # Files first seen opened after the entry was made count too
+        entry = _new_cache_entry(False, dependencies, {})
+        that(not _is_unchanged(entry, False, opened_files))
@@ -415,3 +415,30 @@ public final class Main {
             base.Token(None, 'EOF', None),
         ],
     )
+
+
+@test.case
+def test_lex_source_from_path():
+    import os
+    import tempfile
+    data = r"""
+public final class Main {
+    // comment
+    public static void main(String[] args) {
+        System.out.println("Hello world!" + 'c' + 1.5f + 0x10);
+    }
+}
+"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'Main.java')
+        with open(path, 'w') as f:
+            f.write(data)
+        source = base.Source.from_path(path)
+        test.that(not isinstance(source.data, str))
+        tokens = list(lex(source))
+    expected = list(lex_string(data))
+    test.equal(tokens, expected)
+    test.equal(
+        [(t.mark.start, t.mark.end) for t in tokens],
+        [(t.mark.start, t.mark.end) for t in expected],
+    )
@@ -0,0 +1,236 @@
+"""
+Prime sieves and primality testing
+
+    sieve(limit)                flags for 0 <= n < limit
+    sieve_range(start, stop)    flags for start <= n < stop
+    primes_in_range(start, stop)
+    PrimeTable(limit)           bitset of the odd primes below limit
+    is_prime(n)                 deterministic Miller-Rabin for n < 2 ** 64
+    isqrt(n)                    integer square root (math.isqrt is 3.8+)
+
+The sieves do all of their crossing off with bytearray slice
+assignments, so the inner loops run in C.
+
+USACO solutions are submitted as single files, so the ones that need
+these (e.g. pprime and sprime) carry their own copies, and their tests
+check them against this module.
+"""
+from mtots import test
+
+
+def isqrt(n):
+    """Returns the largest r with r * r <= n, for n >= 0
+    """
+    if n < 0:
+        raise ValueError('isqrt() argument must be nonnegative')
+    if n == 0:
+        return 0
+    # Newton's method, starting from a power of two >= sqrt(n),
+    # decreases until it reaches the floor of the square root
+    r = 1 << (n.bit_length() + 1) // 2
+    while True:
+        s = (r + n // r) // 2
+        if s >= r:
+            return r
+        r = s
+
+
+def sieve(limit):
+    """Returns a bytearray where flags[n] == 1 iff n is prime,
+    for 0 <= n < limit
+    """
+    flags = bytearray([1]) * max(limit, 2)
+    flags[0] = flags[1] = 0
+    for p in range(2, isqrt(limit - 1) + 1 if limit > 1 else 0):
+        if flags[p]:
+            flags[p * p::p] = bytes(len(range(p * p, limit, p)))
+    return flags[:limit]
+
+
+def sieve_range(start, stop, base_primes=None):
+    """Returns a bytearray where flags[n - start] == 1 iff n is prime,
+    for start <= n < stop.
+
+    Only needs the primes up to sqrt(stop), so memory use depends
+    only on the size of the range. base_primes may be given to avoid
+    recomputing them for every segment of a large range.
+    """
+    start = max(start, 0)
+    if stop <= start:
+        return bytearray()
+    if base_primes is None:
+        base_primes = primes_in_range(2, isqrt(stop - 1) + 1)
+    flags = bytearray([1]) * (stop - start)
+    for p in base_primes:
+        if p * p >= stop:
+            break
+        first = max(p * p, (start + p - 1) // p * p)
+        flags[first - start::p] = bytes(len(range(first, stop, p)))
+    for n in range(start, min(stop, 2)):
+        flags[n - start] = 0
+    return flags
+
+
+def primes_in_range(start, stop, *, segment_size=1 << 16):
+    """Returns the list of primes p with start <= p < stop,
+    sieving one segment of the range at a time
+    """
+    if stop <= 2:
+        return []
+    if stop <= segment_size:
+        flags = sieve(stop)
+        return [n for n in range(max(start, 2), stop) if flags[n]]
+    base_primes = primes_in_range(2, isqrt(stop - 1) + 1)
+    primes = []
+    for lo in range(max(start, 2), stop, segment_size):
+        hi = min(lo + segment_size, stop)
+        flags = sieve_range(lo, hi, base_primes)
+        primes.extend(
+            lo + i for i in _nonzero_indices(flags)
+        )
+    return primes
+
+
+def _nonzero_indices(flags):
+    i = flags.find(1)
+    while i != -1:
+        yield i
+        i = flags.find(1, i + 1)
+
+
+_FLAG_TO_DIGIT = bytes.maketrans(b'\x00\x01', b'01')
+
+
+class PrimeTable:
+    """Primality lookup for 0 <= n < limit, with one bit per odd number
+    (i.e. limit / 16 bytes in total)
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        odd_flags = sieve(limit)[1::2]
+
+        # Pack the flags into bits by reading them as a binary number
+        # (with the flag for 1 as the least significant digit)
+        digits = odd_flags.translate(_FLAG_TO_DIGIT)[::-1]
+        self._bits = (int(digits, 2) if digits else 0).to_bytes(
+            len(odd_flags) + 7 >> 3,
+            'little',
+        )
+
+    def __contains__(self, n):
+        return self.is_prime(n)
+
+    def is_prime(self, n):
+        if not 0 <= n < self.limit:
+            raise ValueError(f'{n} is not in range(0, {self.limit})')
+        if n & 1 == 0:
+            return n == 2
+        i = n >> 1
+        return bool(self._bits[i >> 3] >> (i & 7) & 1)
+
+
+# Deterministic for all n < 3.3 * 10 ** 24, which covers 64-bit ints
+_MILLER_RABIN_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+
+def is_prime(n):
+    """Deterministic Miller-Rabin primality test for n < 2 ** 64
+    (and well beyond, see _MILLER_RABIN_BASES)
+    """
+    if n < 2:
+        return False
+    for p in _MILLER_RABIN_BASES:
+        if n % p == 0:
+            return n == p
+    d = n - 1
+    s = 0
+    while d & 1 == 0:
+        d >>= 1
+        s += 1
+    for a in _MILLER_RABIN_BASES:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _is_prime_by_trial_division(n):
+    return n >= 2 and all(n % p for p in range(2, isqrt(n) + 1))
+
+
+@test.case
+def test_isqrt():
+    for n in range(10000):
+        r = isqrt(n)
+        test.that(r * r <= n < (r + 1) * (r + 1), n)
+    for r in (10 ** 8, 2 ** 52 + 1, 10 ** 40 + 7):
+        test.equal(isqrt(r * r - 1), r - 1)
+        test.equal(isqrt(r * r), r)
+        test.equal(isqrt(r * r + 2 * r), r)
+
+    @test.throws(ValueError)
+    def negative():
+        isqrt(-1)
+
+
+@test.case
+def test_sieve():
+    expected = [n for n in range(200) if _is_prime_by_trial_division(n)]
+    flags = sieve(200)
+    test.equal(len(flags), 200)
+    test.equal([n for n in range(200) if flags[n]], expected)
+    test.equal(sieve(0), bytearray())
+    test.equal(sieve(1), bytearray([0]))
+    test.equal(sieve(3), bytearray([0, 0, 1]))
+
+
+@test.case
+def test_sieve_range():
+    for start, stop in [(0, 50), (1, 2), (90, 130), (1000, 1100), (7, 7)]:
+        flags = sieve_range(start, stop)
+        test.equal(
+            [n for n in range(start, stop) if flags[n - start]],
+            [n for n in range(start, stop) if _is_prime_by_trial_division(n)],
+        )
+    test.equal(
+        primes_in_range(10 ** 6, 10 ** 6 + 1000, segment_size=128),
+        [
+            n for n in range(10 ** 6, 10 ** 6 + 1000)
+            if _is_prime_by_trial_division(n)
+        ],
+    )
+    test.equal(len(primes_in_range(0, 10 ** 5, segment_size=1000)), 9592)
+
+
+@test.case
+def test_prime_table():
+    table = PrimeTable(1000)
+    flags = sieve(1000)
+    test.equal([n for n in range(1000) if n in table], [
+        n for n in range(1000) if flags[n]
+    ])
+
+    @test.throws(ValueError)
+    def out_of_range():
+        table.is_prime(1000)
+
+
+@test.case
+def test_is_prime():
+    flags = sieve(10000)
+    test.equal(
+        [n for n in range(10000) if is_prime(n)],
+        [n for n in range(10000) if flags[n]],
+    )
+    # Carmichael numbers and strong pseudoprimes to small bases
+    for n in (561, 1105, 2047, 3215031751, 3825123056546413051):
+        test.that(not is_prime(n), n)
+    for n in (2 ** 31 - 1, 2 ** 61 - 1, 18446744073709551557):
+        test.that(is_prime(n), n)